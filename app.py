@@ -1,147 +1,674 @@
 import asyncio
+import copy
+import hashlib
+import itertools
+import json
+import multiprocessing
 import os
+import queue
+import shutil
+import stat
 import subprocess
 import tempfile
-import uuid
-from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import asynccontextmanager, suppress
+from dataclasses import dataclass
+from functools import lru_cache
 from pathlib import Path
-from typing import Optional
+from typing import Optional, Union
 import yaml
 import logging
-from fastapi import FastAPI, File, UploadFile, HTTPException, BackgroundTasks
-from fastapi.responses import StreamingResponse
-from pydantic import BaseModel
-import aiofiles
+from fastapi import FastAPI, File, UploadFile, HTTPException, BackgroundTasks, Request
+from fastapi.responses import FileResponse, ORJSONResponse
+
+from libreoffice_cli import LIBREOFFICE_ARGS, LIBREOFFICE_ENV, expected_output_path, run_libreoffice_command
+
+try:
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:  # PyYAML built without libyaml
+    from yaml import SafeLoader
+
+try:
+    import uno
+    from com.sun.star.beans import PropertyValue
+    from com.sun.star.connection import NoConnectException
+except ImportError:  # pyuno ships with LibreOffice and is tied to its interpreter
+    uno = None
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Chunk size for streaming uploads to disk and converted documents back
+STREAM_CHUNK = 1 << 20
+
+# RAM-backed filesystem used for temp files when prefer_tmpfs is enabled
+TMPFS_ROOT = "/dev/shm"
+
+def tmpfs_temp_dir(configured: str) -> str:
+    """tmpfs counterpart of a configured temp_dir, private to the current user and that path"""
+    digest = hashlib.md5(os.path.abspath(configured).encode(), usedforsecurity=False).hexdigest()[:12]
+    return os.path.join(TMPFS_ROOT, f"libreoffice-converter-{os.getuid()}-{digest}")
+
+def private_tmpfs_dir(configured: str) -> str:
+    """Create (or reuse) the tmpfs directory for configured, only if it is ours alone
+    
+    Its name is predictable, so anything already there must be a real directory
+    owned by this user with mode 0700; otherwise a fresh mkdtemp directory is used.
+    """
+    path = tmpfs_temp_dir(configured)
+    with suppress(FileExistsError):
+        os.mkdir(path, 0o700)
+    st = os.lstat(path)
+    if stat.S_ISDIR(st.st_mode) and st.st_uid == os.getuid() and stat.S_IMODE(st.st_mode) == 0o700:
+        return path
+    logger.warning(f"{path} is not a private directory of this user; using a fresh one")
+    return tempfile.mkdtemp(prefix=f"libreoffice-converter-{os.getuid()}-", dir=TMPFS_ROOT)
+
+def _select_temp_dir(configured: str, max_file_size: int) -> str:
+    """Use tmpfs for temp files if /dev/shm has room for two maximum-size uploads"""
+    try:
+        stats = os.statvfs(TMPFS_ROOT)
+    except OSError:
+        return configured
+    if stats.f_bavail * stats.f_frsize < 2 * max_file_size:
+        logger.info(f"Not enough free space on tmpfs; using {configured} for temporary files")
+        return configured
+    try:
+        temp_dir = private_tmpfs_dir(configured)
+    except OSError as e:
+        logger.warning(f"Cannot create a tmpfs directory ({str(e)}); using {configured} for temporary files")
+        return configured
+    logger.info(f"Using tmpfs directory {temp_dir} for temporary files")
+    return temp_dir
+
+# Parsed config files by resolved path, with the mtime and size they were parsed at
+CONFIG_CACHE_SIZE = 100
+_config_cache: OrderedDict[str, tuple[int, int, dict]] = OrderedDict()
+
+def _parse_config_text(path: str, text: str) -> dict:
+    """Parse config YAML, going through a JSON sidecar in $CONFIG_CACHE_DIR when it is set
+    
+    The sidecar's first line is the MD5 of the YAML text it was built from, so
+    an edited file is parsed as YAML again and the sidecar rewritten.
+    """
+    cache_dir = os.environ.get("CONFIG_CACHE_DIR")
+    if not cache_dir:
+        return yaml.load(text, Loader=SafeLoader)
+    
+    digest = hashlib.md5(text.encode(), usedforsecurity=False).hexdigest()
+    sidecar = os.path.join(cache_dir, f"{hashlib.md5(path.encode(), usedforsecurity=False).hexdigest()}.json")
+    try:
+        with open(sidecar, 'r') as f:
+            if f.readline().rstrip('\n') == digest:
+                return json.loads(f.read())
+    except (OSError, ValueError):
+        pass
+    
+    raw = yaml.load(text, Loader=SafeLoader)
+    try:
+        payload = f"{digest}\n{json.dumps(raw)}"
+        # Written under a temporary name and renamed, so readers never see a partial file
+        tmp_path = f"{sidecar}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            f.write(payload)
+        os.replace(tmp_path, sidecar)
+    except (OSError, TypeError) as e:
+        logger.warning(f"Could not write config cache {sidecar}: {str(e)}")
+    return raw
+
+def load_config_file(config_path: str) -> dict:
+    """Parse a YAML config file, reusing the previous parse while its mtime and size are unchanged"""
+    path = os.path.realpath(config_path)
+    stat = os.stat(path)
+    cached = _config_cache.get(path)
+    if cached is not None and cached[:2] == (stat.st_mtime_ns, stat.st_size):
+        _config_cache.move_to_end(path)
+        return copy.deepcopy(cached[2])
+    
+    with open(path, 'r') as f:
+        text = f.read()
+    raw = _parse_config_text(path, text)
+    _config_cache[path] = (stat.st_mtime_ns, stat.st_size, raw)
+    _config_cache.move_to_end(path)
+    if len(_config_cache) > CONFIG_CACHE_SIZE:
+        _config_cache.popitem(last=False)
+    return copy.deepcopy(raw)
+
+class FileTooLargeError(Exception):
+    """Raised when an upload exceeds the configured maximum file size"""
+
+@dataclass(frozen=True, slots=True, init=False)
 class Config:
+    """Converter and server settings parsed once from a YAML file"""
+    input_formats: tuple[str, ...]
+    input_formats_set: frozenset[str]
+    output_format: str
+    workers: int
+    temp_dir: str
+    max_file_size: int
+    max_mb_str: str
+    conversion_timeout: int
+    soffice_daemon: bool
+    soffice_base_port: int
+    executor_type: str
+    profile_template: Optional[str]
+    host: str
+    port: int
+    debug: bool
+    
     def __init__(self, config_path: str = "config.yaml"):
-        with open(config_path, 'r') as f:
-            self.config = yaml.safe_load(f)
+        raw = load_config_file(config_path)
+        
+        converter_config = raw['converter']
+        server_config = raw['server']
+        values = {
+            'input_formats': tuple(converter_config['input_formats']),  # Config order, for /formats
+            'input_formats_set': frozenset(fmt.lower() for fmt in converter_config['input_formats']),
+            'output_format': converter_config['output_format'],
+            'workers': converter_config['workers'],
+            'temp_dir': converter_config['temp_dir'],
+            'max_file_size': converter_config['max_file_size'] * 1024 * 1024,  # Convert to bytes
+            'max_mb_str': f"{converter_config['max_file_size']:.1f}MB",  # For error messages
+            'conversion_timeout': converter_config['conversion_timeout'],
+            'soffice_daemon': converter_config.get('soffice_daemon', False),
+            'soffice_base_port': converter_config.get('soffice_base_port', 2002),
+            'executor_type': converter_config.get('executor_type', 'thread'),
+            'profile_template': converter_config.get('profile_template'),
+            'host': server_config['host'],
+            'port': server_config['port'],
+            'debug': server_config['debug'],
+        }
+        if converter_config.get('prefer_tmpfs', False):
+            values['temp_dir'] = _select_temp_dir(values['temp_dir'], values['max_file_size'])
+        if values['executor_type'] not in ('thread', 'process'):
+            raise ValueError(f"Unknown executor_type: {values['executor_type']}")
+        
+        for name, value in values.items():
+            object.__setattr__(self, name, value)
+    
+    @classmethod
+    @lru_cache(maxsize=8)
+    def load(cls, config_path: str = "config.yaml") -> "Config":
+        """Shared Config for a path; Config(path) still builds a fresh instance"""
+        return cls(config_path)
+
+class ConvertedFileResponse(FileResponse):
+    """File response that reads the converted document in large chunks"""
+    chunk_size = STREAM_CHUNK
+
+# Sequence for temporary input names, shared by every converter in the process
+# so two instances using the same temp_dir never pick the same name
+_input_ids = itertools.count()
+
+@lru_cache(maxsize=1024)
+def file_extension(filename: str) -> str:
+    """Lower-cased extension without the dot (cached, as batch uploads often repeat names)"""
+    return os.path.splitext(filename)[1][1:].lower()
+
+def slot_profile(slot: str) -> str:
+    """LibreOffice user profile belonging to an output slot (never inside it, as slots are emptied)"""
+    return f"{slot}_profile"
+
+def seed_profile(template: Optional[str], profile_dir: str):
+    """Copy the prebuilt LibreOffice profile into profile_dir, if configured and not done yet"""
+    if not template or os.path.isdir(profile_dir):
+        return
+    if not os.path.isdir(template):
+        logger.warning(f"LibreOffice profile template {template} not found; profiles are built on first use")
+        return
+    shutil.copytree(template, profile_dir)
+
+# PDF export filter for each kind of document soffice can load
+PDF_EXPORT_FILTERS = {
+    'com.sun.star.text.TextDocument': 'writer_pdf_Export',
+    'com.sun.star.sheet.SpreadsheetDocument': 'calc_pdf_Export',
+    'com.sun.star.presentation.PresentationDocument': 'impress_pdf_Export',
+    'com.sun.star.drawing.DrawingDocument': 'draw_pdf_Export',
+}
+
+def _uno_properties(**kwargs) -> tuple:
+    """Build a tuple of UNO PropertyValue structs from keyword arguments"""
+    props = []
+    for name, value in kwargs.items():
+        prop = PropertyValue()
+        prop.Name = name
+        prop.Value = value
+        props.append(prop)
+    return tuple(props)
+
+class SofficeWorker:
+    """A long-running headless soffice instance reachable over a UNO socket"""
+    
+    def __init__(self, port: int, profile_dir: str):
+        self.port = port
+        self.profile_dir = profile_dir
+        self.process: Optional[subprocess.Popen] = None
+        self._desktop = None
+    
+    def start(self):
+        """Launch soffice listening on this worker's port"""
+        self._desktop = None
+        self.process = subprocess.Popen(
+            [
+                *LIBREOFFICE_ARGS,
+                f'--accept=socket,host=127.0.0.1,port={self.port};urp;StarOffice.ComponentContext',
+                f'-env:UserInstallation={Path(self.profile_dir).as_uri()}'
+            ],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            env=LIBREOFFICE_ENV
+        )
+    
+    def connect(self, timeout: float):
+        """Wait for soffice to accept UNO connections and bind its desktop"""
+        local_context = uno.getComponentContext()
+        resolver = local_context.ServiceManager.createInstanceWithContext(
+            'com.sun.star.bridge.UnoUrlResolver', local_context
+        )
+        url = f'uno:socket,host=127.0.0.1,port={self.port};urp;StarOffice.ComponentContext'
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                context = resolver.resolve(url)
+                break
+            except NoConnectException:
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.25)
+        self._desktop = context.ServiceManager.createInstanceWithContext('com.sun.star.frame.Desktop', context)
+    
+    def convert(self, input_path: str, output_path: str, timeout: float):
+        """Convert input_path to PDF at output_path through the running instance"""
+        if self.process is None or self.process.poll() is not None:
+            self.start()
+        if self._desktop is None:
+            self.connect(timeout)
         
-        self.input_formats = self.config['converter']['input_formats']
-        self.output_format = self.config['converter']['output_format']
-        self.workers = self.config['converter']['workers']
-        self.temp_dir = self.config['converter']['temp_dir']
-        self.max_file_size = self.config['converter']['max_file_size'] * 1024 * 1024  # Convert to bytes
-        self.conversion_timeout = self.config['converter']['conversion_timeout']
-        self.host = self.config['server']['host']
-        self.port = self.config['server']['port']
-        self.debug = self.config['server']['debug']
-
-class ConversionResult(BaseModel):
-    success: bool
-    message: str
-    file_id: Optional[str] = None
+        # UNO calls have no deadline of their own, so a watchdog kills soffice if
+        # the document is not converted in time; the next checkout restarts it
+        process = self.process
+        timed_out = threading.Event()
+        
+        def kill():
+            timed_out.set()
+            process.kill()
+        
+        watchdog = threading.Timer(timeout, kill)
+        watchdog.start()
+        try:
+            self._export(input_path, output_path)
+        except Exception:
+            if timed_out.is_set():
+                raise TimeoutError(f"soffice did not finish within {timeout}s") from None
+            raise
+        finally:
+            watchdog.cancel()
+            if timed_out.is_set():
+                self._desktop = None
+    
+    def _export(self, input_path: str, output_path: str):
+        """Load input_path into the running instance and export it as PDF"""
+        document = self._desktop.loadComponentFromURL(
+            uno.systemPathToFileUrl(os.path.abspath(input_path)), '_blank', 0, _uno_properties(Hidden=True)
+        )
+        if document is None:
+            raise RuntimeError("Document could not be loaded")
+        try:
+            filter_name = next(
+                (name for service, name in PDF_EXPORT_FILTERS.items() if document.supportsService(service)),
+                'writer_pdf_Export'
+            )
+            document.storeToURL(
+                uno.systemPathToFileUrl(os.path.abspath(output_path)), _uno_properties(FilterName=filter_name)
+            )
+        finally:
+            document.close(True)
+    
+    def reset(self):
+        """Forget the UNO session; convert() restarts soffice if it has exited"""
+        self._desktop = None
+    
+    def stop(self):
+        """Shut soffice down, killing it if it does not exit in time"""
+        if self._desktop is not None:
+            try:
+                self._desktop.terminate()
+            except Exception:
+                pass
+            self._desktop = None
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+        self.process = None
+
+class SofficePool:
+    """Fixed set of soffice workers, each used by a single conversion at a time"""
+    
+    def __init__(self, config: Config):
+        self.config = config
+        self.workers = [
+            SofficeWorker(
+                config.soffice_base_port + i,
+                os.path.join(config.temp_dir, f"soffice_profile_{i}")
+            )
+            for i in range(config.workers)
+        ]
+        self._idle: queue.Queue[SofficeWorker] = queue.Queue()
+    
+    def start(self):
+        """Launch every worker and wait until all of them accept connections"""
+        for worker in self.workers:
+            seed_profile(self.config.profile_template, worker.profile_dir)
+            worker.start()
+        for worker in self.workers:
+            worker.connect(self.config.conversion_timeout)
+            self._idle.put(worker)
+        logger.info(f"Started {len(self.workers)} persistent soffice workers")
+    
+    def stop(self):
+        """Shut down every worker"""
+        for worker in self.workers:
+            worker.stop()
+    
+    def convert(self, input_path: str, output_dir: str) -> tuple[bool, str, Optional[str]]:
+        """Check out an idle worker and convert input_path into output_dir"""
+        output_path = expected_output_path(input_path, output_dir, self.config.output_format)
+        worker = self._idle.get()
+        try:
+            worker.convert(input_path, output_path, self.config.conversion_timeout)
+        except TimeoutError as e:
+            logger.warning(f"soffice worker on port {worker.port} timed out: {str(e)}")
+            worker.reset()
+            return False, "Conversion timeout", None
+        except Exception as e:
+            # Drop the session so the next checkout reconnects (or restarts soffice)
+            logger.warning(f"soffice worker on port {worker.port} failed: {str(e)}")
+            worker.reset()
+            return False, f"soffice worker error: {str(e)}", None
+        finally:
+            self._idle.put(worker)
+        
+        if os.path.exists(output_path):
+            return True, "Conversion successful", output_path
+        return False, "No output file generated", None
 
 class DocumentConverter:
     def __init__(self, config: Config):
         self.config = config
-        self.executor = ThreadPoolExecutor(max_workers=config.workers)
+        if config.executor_type == 'process':
+            # Workers only need the conversion command, so the forkserver preloads
+            # that module instead of __main__ (importing app would load the config)
+            mp_context = multiprocessing.get_context('forkserver')
+            mp_context.set_forkserver_preload(['libreoffice_cli'])
+            self.executor = ProcessPoolExecutor(max_workers=config.workers, mp_context=mp_context)
+        else:
+            self.executor = ThreadPoolExecutor(max_workers=config.workers)
+        self.soffice_pool: Optional[SofficePool] = None
+        
+        # Output directories are preallocated and reused, so requests never
+        # mkdir/rmdir on the hot path; one is held from conversion until its
+        # output has been sent. start_slots creates them under a root private
+        # to this converter, so other converters sharing temp_dir never touch them
+        self.slot_root: Optional[str] = None
+        self.slots: frozenset[str] = frozenset()
+        self.slot_q: asyncio.Queue[str] = asyncio.Queue()
+    
+    def start_slots(self):
+        """Create this converter's output slots under a fresh root in temp_dir"""
+        os.makedirs(self.config.temp_dir, exist_ok=True)
+        self.slot_root = tempfile.mkdtemp(prefix="slots-", dir=self.config.temp_dir)
+        self.slots = frozenset(
+            os.path.join(self.slot_root, f"slot_{i}") for i in range(self.config.workers * 2)
+        )
+        self.slot_q = asyncio.Queue()
+        for slot in sorted(self.slots):
+            os.mkdir(slot)
+            seed_profile(self.config.profile_template, slot_profile(slot))
+            self.slot_q.put_nowait(slot)
+    
+    def start_worker_processes(self):
+        """Spawn every process-pool worker up front so requests never wait on a fork"""
+        if self.config.executor_type != 'process':
+            return
+        futures = [self.executor.submit(os.getpid) for _ in range(self.config.workers)]
+        pids = {future.result() for future in futures}
+        logger.info(f"Started {len(pids)} conversion worker processes")
+    
+    def start_soffice_pool(self):
+        """Start persistent soffice workers when enabled and supported"""
+        if not self.config.soffice_daemon:
+            return
+        if self.config.executor_type == 'process':
+            logger.warning("soffice_daemon is ignored with the process executor; using per-request processes")
+            return
+        if uno is None:
+            logger.warning("soffice_daemon is enabled but the uno module is unavailable; using per-request processes")
+            return
+        if self.config.output_format != 'pdf':
+            logger.warning("soffice_daemon only supports pdf output; using per-request processes")
+            return
         
-        # Ensure temp directory exists
-        os.makedirs(config.temp_dir, exist_ok=True)
+        pool = SofficePool(self.config)
+        try:
+            pool.start()
+        except Exception as e:
+            logger.error(f"Failed to start soffice workers: {str(e)}")
+            pool.stop()
+            return
+        self.soffice_pool = pool
+    
+    def stop_soffice_pool(self):
+        """Stop persistent soffice workers if they were started"""
+        if self.soffice_pool is not None:
+            self.soffice_pool.stop()
+            self.soffice_pool = None
+    
+    def close(self):
+        """Remove this converter's output slots and their profiles"""
+        if self.slot_root is not None:
+            shutil.rmtree(self.slot_root, ignore_errors=True)
+        self.slot_root = None
+        self.slots = frozenset()
+        self.slot_q = asyncio.Queue()
+    
+    def _clear_slot(self, slot: str):
+        """Remove whatever a previous conversion left in an output slot, directories included"""
+        try:
+            entries = os.scandir(slot)
+        except FileNotFoundError:
+            # Something removed the slot itself; recreate it so it stays usable
+            os.makedirs(slot, exist_ok=True)
+            return
+        with entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        shutil.rmtree(entry.path)
+                    else:
+                        os.remove(entry.path)
+                except OSError as e:
+                    logger.warning(f"Failed to cleanup {entry.path}: {str(e)}")
+    
+    async def release_slot(self, slot: str):
+        """Empty an output slot and hand it back for the next conversion"""
+        if slot not in self.slots:
+            logger.warning(f"Refusing to release {slot}: not an output slot")
+            return
+        try:
+            await asyncio.to_thread(self._clear_slot, slot)
+        except OSError as e:
+            logger.warning(f"Failed to cleanup {slot}: {str(e)}")
+        finally:
+            # Always handed back, as a lost slot would never come back
+            self.slot_q.put_nowait(slot)
     
     def _get_file_extension(self, filename: str) -> str:
         """Extract file extension from filename"""
-        return Path(filename).suffix.lower().lstrip('.')
+        return file_extension(filename)
+    
+    def output_filename(self, filename: str) -> str:
+        """Download name for a converted upload: its stem with the output extension"""
+        stem = os.path.splitext(os.path.basename(filename))[0]
+        return f"{stem}.{self.config.output_format}"
     
     def _validate_input_format(self, filename: str) -> bool:
         """Validate if input format is supported"""
         ext = self._get_file_extension(filename)
-        return ext in self.config.input_formats
+        return ext in self.config.input_formats_set
     
-    async def convert_document(self, file_content: bytes, filename: str) -> tuple[bool, str, Optional[str]]:
-        """Convert document using LibreOffice"""
-        if not self._validate_input_format(filename):
-            return False, f"Unsupported input format: {self._get_file_extension(filename)}", None
+    async def _save_upload(self, upload: UploadFile, input_path: str):
+        """Stream an upload to disk in bounded chunks, enforcing the size limit"""
+        total = 0
+        with open(input_path, 'wb', buffering=STREAM_CHUNK) as f:
+            while chunk := await upload.read(STREAM_CHUNK):
+                total += len(chunk)
+                if total > self.config.max_file_size:
+                    raise FileTooLargeError(
+                        f"File too large. Maximum size: {self.config.max_mb_str}"
+                    )
+                await asyncio.to_thread(f.write, chunk)
+    
+    async def convert_document(
+        self, source: Union[bytes, str, UploadFile], filename: str
+    ) -> tuple[bool, str, Optional[str]]:
+        """Convert document using LibreOffice
         
-        file_id = str(uuid.uuid4())
-        input_path = os.path.join(self.config.temp_dir, f"{file_id}_input.{self._get_file_extension(filename)}")
-        output_dir = os.path.join(self.config.temp_dir, file_id)
+        source is the document bytes, the path of a file already on disk (read
+        in place and left for the caller to remove), or an upload that is
+        streamed to disk; FileTooLargeError is raised if an upload exceeds
+        max_file_size. On success the output lives in an output slot that the
+        caller must hand back with release_slot once it is done with the file.
+        """
+        ext = self._get_file_extension(filename)
+        if ext not in self.config.input_formats_set:
+            return False, f"Unsupported input format: {ext}", None
+        
+        # A file already on disk is handed to LibreOffice as is, skipping the copy
+        owns_input = not isinstance(source, str)
+        if owns_input:
+            file_id = f"{os.getpid()}-{next(_input_ids)}"
+            input_path = os.path.join(self.config.temp_dir, f"{file_id}_input.{ext}")
+        else:
+            input_path = source
+        output_dir = await self.slot_q.get()
+        success = False
         
         try:
-            # Create output directory
-            os.makedirs(output_dir, exist_ok=True)
-            
             # Write input file
-            async with aiofiles.open(input_path, 'wb') as f:
-                await f.write(file_content)
+            if isinstance(source, bytes):
+                await asyncio.to_thread(Path(input_path).write_bytes, source)
+            elif owns_input:
+                await self._save_upload(source, input_path)
             
-            # Run conversion in thread pool
-            loop = asyncio.get_event_loop()
-            success, message, output_file = await loop.run_in_executor(
-                self.executor, 
-                self._run_libreoffice_conversion, 
-                input_path, 
-                output_dir
-            )
+            # Run conversion in the worker pool. Worker processes cannot reach the
+            # soffice pool, so they get the plain command runner, and submit() may
+            # start a worker process, so it is called off the event loop
+            if self.config.executor_type == 'process':
+                future = await asyncio.to_thread(
+                    self.executor.submit,
+                    run_libreoffice_command,
+                    input_path,
+                    output_dir,
+                    self.config.output_format,
+                    self.config.conversion_timeout,
+                    slot_profile(output_dir)
+                )
+                success, message, output_file = await asyncio.wrap_future(future)
+            else:
+                loop = asyncio.get_event_loop()
+                success, message, output_file = await loop.run_in_executor(
+                    self.executor,
+                    self._run_libreoffice_conversion,
+                    input_path,
+                    output_dir,
+                    slot_profile(output_dir)
+                )
             
             if success:
                 return True, "Conversion successful", output_file
             else:
                 return False, message, None
                 
+        except FileTooLargeError:
+            raise
         except Exception as e:
             logger.error(f"Conversion error for {filename}: {str(e)}")
             return False, f"Conversion failed: {str(e)}", None
         finally:
-            # Clean up input file
-            if os.path.exists(input_path):
-                os.remove(input_path)
+            # Clean up input file (absent only if writing it failed early)
+            if owns_input:
+                with suppress(FileNotFoundError):
+                    await asyncio.to_thread(os.remove, input_path)
+            if not success:
+                await self.release_slot(output_dir)
     
-    def _run_libreoffice_conversion(self, input_path: str, output_dir: str) -> tuple[bool, str, Optional[str]]:
-        """Run LibreOffice conversion command"""
-        try:
-            # LibreOffice command with additional headless flags
-            cmd = [
-                'libreoffice',
-                '--headless',
-                '--invisible',
-                '--nodefault',
-                '--nolockcheck',
-                '--nologo',
-                '--norestore',
-                '--convert-to', self.config.output_format,
-                '--outdir', output_dir,
-                input_path
-            ]
-            
-            # Run conversion with environment variables for headless mode
-            env = os.environ.copy()
-            env['DISPLAY'] = ''
-            env['SAL_USE_VCLPLUGIN'] = 'svp'
-            
-            result = subprocess.run(
-                cmd,
-                timeout=self.config.conversion_timeout,
-                capture_output=True,
-                text=True,
-                env=env
-            )
-            
-            if result.returncode == 0:
-                # Find the output file
-                output_files = list(Path(output_dir).glob(f"*.{self.config.output_format}"))
-                if output_files:
-                    return True, "Conversion successful", str(output_files[0])
-                else:
-                    return False, "No output file generated", None
-            else:
-                return False, f"LibreOffice error: {result.stderr}", None
-                
-        except subprocess.TimeoutExpired:
-            return False, "Conversion timeout", None
-        except Exception as e:
-            return False, f"Conversion error: {str(e)}", None
+    def _run_libreoffice_conversion(
+        self, input_path: str, output_dir: str, profile_dir: Optional[str] = None
+    ) -> tuple[bool, str, Optional[str]]:
+        """Run LibreOffice conversion, preferring a persistent soffice worker"""
+        if self.soffice_pool is not None:
+            success, message, output_file = self.soffice_pool.convert(input_path, output_dir)
+            # A document that timed out in soffice would only time out again
+            if success or message == "Conversion timeout":
+                return success, message, output_file
+            logger.warning(f"Falling back to a one-off LibreOffice process: {message}")
+        
+        return run_libreoffice_command(
+            input_path, output_dir, self.config.output_format, self.config.conversion_timeout, profile_dir
+        )
 
 # Initialize config and converter
-config = Config()
+config = Config.load(os.environ.get("CONFIG_PATH", "config.yaml"))
 converter = DocumentConverter(config)
-app = FastAPI(title="LibreOffice Document Converter", version="1.0.0")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await asyncio.to_thread(converter.start_slots)
+    await asyncio.to_thread(converter.start_worker_processes)
+    await asyncio.to_thread(converter.start_soffice_pool)
+    yield
+    await asyncio.to_thread(converter.stop_soffice_pool)
+    await asyncio.to_thread(converter.close)
+
+class UploadSizeLimitMiddleware:
+    """Reject uploads whose Content-Length is over the limit before the body is read
+    
+    FastAPI parses the multipart body before the endpoint runs, so this has to
+    happen in front of the app. Uploads without a Content-Length (chunked) are
+    still checked while streaming to disk.
+    """
+    def __init__(self, app):
+        self.app = app
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"] in ("/convert", "/convert/batch"):
+            limit = config.max_file_size
+            if scope["path"] == "/convert/batch":
+                limit *= config.workers * 2
+            declared = Request(scope).headers.get("content-length", "")
+            if declared.isdigit() and int(declared) > limit:
+                response = ORJSONResponse(
+                    status_code=413,
+                    content={"detail": f"File too large. Maximum size: {config.max_mb_str}"}
+                )
+                await response(scope, receive, send)
+                return
+        await self.app(scope, receive, send)
+
+app = FastAPI(
+    title="LibreOffice Document Converter",
+    version="1.0.0",
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse
+)
+app.add_middleware(UploadSizeLimitMiddleware)
 
 @app.get("/")
 async def root():
@@ -162,57 +689,49 @@ async def supported_formats():
 async def convert_document(background_tasks: BackgroundTasks, file: UploadFile = File(...)):
     """Convert uploaded document"""
     
-    # Validate file size
-    file_content = await file.read()
-    if len(file_content) > config.max_file_size:
-        raise HTTPException(
-            status_code=413,
-            detail=f"File too large. Maximum size: {config.max_file_size / (1024*1024):.1f}MB"
-        )
-    
     # Validate filename
     if not file.filename:
         raise HTTPException(status_code=400, detail="No filename provided")
     
     try:
-        # Convert document
-        success, message, output_file = await converter.convert_document(file_content, file.filename)
+        # Convert document, streaming the upload to disk
+        success, message, output_file = await converter.convert_document(file, file.filename)
         
         if not success:
             raise HTTPException(status_code=400, detail=message)
         
-        if not output_file or not os.path.exists(output_file):
-            raise HTTPException(status_code=500, detail="Conversion failed - no output file")
+        # The stat is handed to the response, which would otherwise repeat it in a thread
+        output_stat = None
+        if output_file:
+            with suppress(FileNotFoundError):
+                output_stat = os.stat(output_file)
         
-        # Stream the converted file
-        async def stream_file():
-            try:
-                async with aiofiles.open(output_file, 'rb') as f:
-                    while chunk := await f.read(8192):
-                        yield chunk
-            finally:
-                # Clean up output file in background
-                background_tasks.add_task(cleanup_file, output_file)
-                background_tasks.add_task(cleanup_dir, os.path.dirname(output_file))
+        if output_stat is None:
+            if output_file:
+                await converter.release_slot(os.path.dirname(output_file))
+            raise HTTPException(status_code=500, detail="Conversion failed - no output file")
         
-        # Generate output filename
-        base_name = Path(file.filename).stem
-        output_filename = f"{base_name}.{config.output_format}"
+        # Free the output slot once the response is sent
+        background_tasks.add_task(converter.release_slot, os.path.dirname(output_file))
         
-        return StreamingResponse(
-            stream_file(),
+        return ConvertedFileResponse(
+            output_file,
+            stat_result=output_stat,
             media_type="application/octet-stream",
-            headers={"Content-Disposition": f"attachment; filename={output_filename}"}
+            filename=converter.output_filename(file.filename),
+            background=background_tasks
         )
         
     except HTTPException:
         raise
+    except FileTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
     except Exception as e:
         logger.error(f"Unexpected error: {str(e)}")
         raise HTTPException(status_code=500, detail="Internal server error")
 
 @app.post("/convert/batch")
-async def convert_batch(background_tasks: BackgroundTasks, files: list[UploadFile] = File(...)):
+async def convert_batch(files: list[UploadFile] = File(...)):
     """Convert multiple documents in parallel"""
     
     if len(files) > config.workers * 2:
@@ -224,18 +743,8 @@ async def convert_batch(background_tasks: BackgroundTasks, files: list[UploadFil
     results = []
     tasks = []
     
-    # Create conversion tasks
+    # Start a conversion task per file right away
     for file in files:
-        file_content = await file.read()
-        
-        if len(file_content) > config.max_file_size:
-            results.append({
-                "filename": file.filename,
-                "success": False,
-                "message": f"File too large. Maximum size: {config.max_file_size / (1024*1024):.1f}MB"
-            })
-            continue
-        
         if not file.filename:
             results.append({
                 "filename": "unknown",
@@ -244,55 +753,49 @@ async def convert_batch(background_tasks: BackgroundTasks, files: list[UploadFil
             })
             continue
         
-        task = converter.convert_document(file_content, file.filename)
+        task = asyncio.create_task(converter.convert_document(file, file.filename))
         tasks.append((file.filename, task))
     
-    # Execute conversions in parallel
-    for filename, task in tasks:
-        try:
-            success, message, output_file = await task
-            
-            result = {
+    # Wait for all conversions, which run in parallel
+    outcomes = await asyncio.gather(*(task for _, task in tasks), return_exceptions=True)
+    
+    for (filename, _), outcome in zip(tasks, outcomes):
+        if isinstance(outcome, FileTooLargeError):
+            results.append({
                 "filename": filename,
-                "success": success,
-                "message": message
-            }
+                "success": False,
+                "message": str(outcome)
+            })
+        elif isinstance(outcome, Exception):
+            logger.error(f"Batch conversion error for {filename}: {str(outcome)}")
+            results.append({
+                "filename": filename,
+                "success": False,
+                "message": f"Conversion failed: {str(outcome)}"
+            })
+        else:
+            success, message, output_file = outcome
             
             if output_file:
-                # Schedule cleanup
-                background_tasks.add_task(cleanup_file, output_file)
-                background_tasks.add_task(cleanup_dir, os.path.dirname(output_file))
-            
-            results.append(result)
+                # Batch results carry no file contents, so the slot is freed right away
+                await converter.release_slot(os.path.dirname(output_file))
             
-        except Exception as e:
-            logger.error(f"Batch conversion error for {filename}: {str(e)}")
             results.append({
                 "filename": filename,
-                "success": False,
-                "message": f"Conversion failed: {str(e)}"
+                "success": success,
+                "message": message
             })
     
-    return {"results": results}
-
-async def cleanup_file(file_path: str):
-    """Clean up temporary file"""
-    try:
-        if os.path.exists(file_path):
-            os.remove(file_path)
-    except Exception as e:
-        logger.warning(f"Failed to cleanup file {file_path}: {str(e)}")
-
-async def cleanup_dir(dir_path: str):
-    """Clean up temporary directory"""
-    try:
-        if os.path.exists(dir_path) and os.path.isdir(dir_path):
-            # Only remove if empty
-            if not os.listdir(dir_path):
-                os.rmdir(dir_path)
-    except Exception as e:
-        logger.warning(f"Failed to cleanup directory {dir_path}: {str(e)}")
+    # Results are plain dicts, so skip jsonable_encoder and serialize directly
+    return ORJSONResponse({"results": results})
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host=config.host, port=config.port, debug=config.debug)
\ No newline at end of file
+    uvicorn.run(
+        app,
+        host=config.host,
+        port=config.port,
+        loop="uvloop",
+        http="httptools",
+        log_level="debug" if config.debug else "info"
+    )
\ No newline at end of file
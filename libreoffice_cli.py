@@ -0,0 +1,64 @@
+import os
+import shutil
+import subprocess
+from pathlib import Path
+from types import MappingProxyType
+from typing import Optional
+
+# One-off LibreOffice conversions, kept apart from app so process-pool workers
+# can import them without loading the config or building a converter
+
+# Headless flags shared by every LibreOffice process, built once. The binary is
+# resolved against $PATH here so exec does not search it for every conversion
+LIBREOFFICE_ARGS = (
+    shutil.which('libreoffice') or 'libreoffice',
+    '--headless',
+    '--invisible',
+    '--nodefault',
+    '--nolockcheck',
+    '--nologo',
+    '--norestore',
+)
+
+# Environment for headless LibreOffice, built once and read-only since every process shares it
+LIBREOFFICE_ENV = MappingProxyType({**os.environ, 'DISPLAY': '', 'SAL_USE_VCLPLUGIN': 'svp'})
+
+def expected_output_path(input_path: str, output_dir: str, output_format: str) -> str:
+    """Path LibreOffice writes to: the input's stem with the output extension, in output_dir"""
+    stem = os.path.splitext(os.path.basename(input_path))[0]
+    return os.path.join(output_dir, f"{stem}.{output_format}")
+
+def run_libreoffice_command(
+    input_path: str, output_dir: str, output_format: str, timeout: int, profile_dir: Optional[str] = None
+) -> tuple[bool, str, Optional[str]]:
+    """Run a one-off LibreOffice conversion process (importable on its own so process pools can pickle it)
+    
+    profile_dir is a LibreOffice user profile used by one conversion at a time;
+    once created it is reused, so later runs skip first-start bootstrapping.
+    """
+    output_path = expected_output_path(input_path, output_dir, output_format)
+    try:
+        # Only the per-request paths are spliced onto the shared flags
+        profile = (f'-env:UserInstallation={Path(profile_dir).as_uri()}',) if profile_dir else ()
+        cmd = (*LIBREOFFICE_ARGS, *profile, '--convert-to', output_format, '--outdir', output_dir, input_path)
+        
+        result = subprocess.run(
+            cmd,
+            timeout=timeout,
+            capture_output=True,
+            text=True,
+            env=LIBREOFFICE_ENV
+        )
+        
+        if result.returncode == 0:
+            if os.path.exists(output_path):
+                return True, "Conversion successful", output_path
+            else:
+                return False, "No output file generated", None
+        else:
+            return False, f"LibreOffice error: {result.stderr}", None
+            
+    except subprocess.TimeoutExpired:
+        return False, "Conversion timeout", None
+    except Exception as e:
+        return False, f"Conversion error: {str(e)}", None
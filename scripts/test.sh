@@ -78,7 +78,7 @@ case $TEST_TYPE in
         print_status $YELLOW "Checking LibreOffice installation for integration tests..."
         if command_exists libreoffice; then
             print_status $GREEN "✅ LibreOffice found"
-            run_tests "integration" "-m integration tests/"
+            run_tests "integration" "-m integration -n auto --dist loadgroup tests/"
         else
             print_status $YELLOW "⚠️  LibreOffice not found - skipping integration tests"
             print_status $YELLOW "To install LibreOffice: sudo apt-get install libreoffice"
@@ -102,7 +102,7 @@ case $TEST_TYPE in
         
         # Run integration tests if LibreOffice is available
         if command_exists libreoffice; then
-            if ! run_tests "integration" "-m integration tests/"; then
+            if ! run_tests "integration" "-m integration -n auto --dist loadgroup tests/"; then
                 exit 1
             fi
         else
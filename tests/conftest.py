@@ -1,19 +1,28 @@
 import asyncio
+import io
 import os
 import tempfile
+from contextlib import suppress
 from pathlib import Path
+from types import MappingProxyType
 from typing import Generator, AsyncGenerator
+from unittest.mock import patch
 import pytest
 import pytest_asyncio
 from fastapi.testclient import TestClient
-from httpx import AsyncClient
+from httpx import ASGITransport, AsyncClient, Limits
 import yaml
 
 # Add the src directory to the path for imports
 import sys
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
 
-from app import app, config, converter
+# pytest-xdist worker running this process ("gw0" when not distributed); each
+# worker gets its own temp_dir, and with it its own LibreOffice profiles
+XDIST_WORKER = os.environ.get("PYTEST_XDIST_WORKER", "gw0")
+
+# Converter temp_dir for tests, kept in RAM when /dev/shm is available
+TEST_TEMP_ROOT = "/dev/shm/converter_tests" if os.path.isdir("/dev/shm") else "/tmp/converter_test"
 
 # Test configuration
 TEST_CONFIG = {
@@ -21,7 +30,7 @@ TEST_CONFIG = {
         'input_formats': ['docx', 'doc', 'odt', 'rtf', 'txt', 'xlsx', 'xls', 'ods', 'pptx', 'ppt', 'odp'],
         'output_format': 'pdf',
         'workers': 2,
-        'temp_dir': '/tmp/converter_test',
+        'temp_dir': os.path.join(TEST_TEMP_ROOT, XDIST_WORKER),
         'max_file_size': 10,
         'conversion_timeout': 30
     },
@@ -32,6 +41,20 @@ TEST_CONFIG = {
     }
 }
 
+# The app's own config: config.yaml with this worker's temp_dir, so tests
+# that inspect or clean the app's temp_dir never see another run's files
+APP_CONFIG_PATH = os.path.join(TEST_TEMP_ROOT, f"{XDIST_WORKER}.yaml")
+with open(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'config.yaml')) as f:
+    _app_config = yaml.safe_load(f)
+_app_config['converter']['temp_dir'] = TEST_CONFIG['converter']['temp_dir']
+_app_config['converter']['prefer_tmpfs'] = False
+os.makedirs(TEST_TEMP_ROOT, exist_ok=True)
+with open(APP_CONFIG_PATH, 'w') as f:
+    yaml.safe_dump(_app_config, f)
+os.environ["CONFIG_PATH"] = APP_CONFIG_PATH
+
+from app import app, Config, DocumentConverter, _config_cache
+
 @pytest.fixture(scope="session")
 def event_loop():
     """Create an instance of the default event loop for the test session."""
@@ -44,6 +67,38 @@ def test_config():
     """Provide test configuration."""
     return TEST_CONFIG
 
+@pytest.fixture
+def config(test_config):
+    """Provide a Config built from the test configuration."""
+    with patch('yaml.load', return_value=test_config):
+        with patch('builtins.open', return_value=io.StringIO()):
+            return Config()
+
+@pytest.fixture
+def converter(config):
+    """Provide a document converter with its output slots created."""
+    converter = DocumentConverter(config)
+    converter.start_slots()
+    yield converter
+    converter.close()
+
+@pytest.fixture(scope="session", autouse=True)
+def converter_temp_dir():
+    """Remove this worker's converter temp_dir once the session is over."""
+    temp_dir = TEST_CONFIG['converter']['temp_dir']
+    yield temp_dir
+    import shutil
+    shutil.rmtree(temp_dir, ignore_errors=True)
+    with suppress(FileNotFoundError):
+        os.remove(APP_CONFIG_PATH)
+
+@pytest.fixture(scope="session")
+def test_config_path(tmp_path_factory):
+    """Write the test configuration to a YAML file for tests that load a real Config."""
+    path = tmp_path_factory.mktemp("config") / "config-test.yaml"
+    path.write_text(yaml.safe_dump(TEST_CONFIG))
+    return str(path)
+
 @pytest.fixture(scope="session")
 def test_temp_dir():
     """Create and provide a temporary directory for tests."""
@@ -77,7 +132,7 @@ def sample_txt(fixtures_dir):
 
 @pytest.fixture(scope="session")
 def create_test_files(fixtures_dir):
-    """Create test files if they don't exist."""
+    """Create test files if they don't exist and provide their contents by file name, read once per session."""
     fixtures_dir.mkdir(exist_ok=True)
     
     # Create a simple text file
@@ -103,28 +158,46 @@ def create_test_files(fixtures_dir):
 """
         html_file.write_text(html_content)
     
-    return fixtures_dir
+    return MappingProxyType({path.name: path.read_bytes() for path in (txt_file, html_file)})
 
-@pytest.fixture
+@pytest.fixture(scope="module")
 def client():
-    """Provide a test client for the FastAPI application."""
-    return TestClient(app)
+    """Provide a test client for the FastAPI application, started once per module."""
+    with TestClient(app) as test_client:
+        yield test_client
 
-@pytest_asyncio.fixture
-async def async_client():
-    """Provide an async test client for the FastAPI application."""
-    async with AsyncClient(app=app, base_url="http://test") as ac:
+@pytest_asyncio.fixture(scope="module", loop_scope="module")
+async def async_client(client):
+    """Provide an async test client for the FastAPI application, shared by every test in a module.
+    
+    ASGITransport does not run the lifespan, so this rides on the module's
+    TestClient, which has already started the converter.
+    """
+    async with AsyncClient(
+        transport=ASGITransport(app=app),
+        base_url="http://test",
+        limits=Limits(max_keepalive_connections=20, max_connections=100)
+    ) as ac:
         yield ac
 
 @pytest.fixture
 def mock_converter(mocker):
     """Provide a mocked converter for testing."""
     mock_conv = mocker.patch('app.converter')
-    mock_conv.convert_document.return_value = asyncio.coroutine(
-        lambda: (True, "Conversion successful", "/tmp/test_output.pdf")
-    )()
+    mock_conv.convert_document = mocker.AsyncMock(
+        return_value=(True, "Conversion successful", "/tmp/test_output.pdf")
+    )
     return mock_conv
 
+@pytest.fixture
+def fake_fs(fs, test_temp_dir):
+    """Provide an in-memory filesystem (pyfakefs) for tests that only touch files."""
+    project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    fs.add_real_file(os.path.join(project_root, 'config.yaml'))
+    fs.create_dir(test_temp_dir)
+    os.chdir(project_root)
+    return fs
+
 @pytest.fixture
 def temp_file():
     """Create a temporary file for testing."""
@@ -166,6 +239,13 @@ def setup_test_environment(test_temp_dir, monkeypatch):
     if os.path.exists(test_temp_dir):
         shutil.rmtree(test_temp_dir, ignore_errors=True)
 
+@pytest.fixture(autouse=True)
+def clear_config_cache():
+    """Make every test parse config files afresh, so patched loaders take effect."""
+    _config_cache.clear()
+    yield
+    _config_cache.clear()
+
 @pytest.fixture
 def mock_subprocess_success(mocker):
     """Mock successful subprocess execution."""
@@ -228,6 +308,9 @@ def pytest_configure(config):
     config.addinivalue_line(
         "markers", "unit: marks tests as unit tests"
     )
+    config.addinivalue_line(
+        "markers", "xdist_group(name): runs the marked tests on a single pytest-xdist worker"
+    )
 
 def pytest_collection_modifyitems(config, items):
     """Modify test collection to add markers."""
@@ -2,20 +2,29 @@ import pytest
 import asyncio
 import os
 import tempfile
+import shutil
+import stat
+import threading
 from pathlib import Path
 from unittest.mock import AsyncMock, MagicMock, patch
 from fastapi.testclient import TestClient
 from httpx import AsyncClient
 import io
+import copy
+from concurrent.futures import ProcessPoolExecutor
+import yaml
 
-from app import app, DocumentConverter, Config
+from fastapi import UploadFile
+
+import app as app_module
+from app import app, DocumentConverter, Config, FileTooLargeError
 
 class TestConfig:
     """Test configuration loading and validation."""
     
     def test_config_loading(self, test_config):
         """Test configuration loading from dict."""
-        with patch('yaml.safe_load', return_value=test_config):
+        with patch('yaml.load', return_value=test_config):
             with patch('builtins.open', return_value=io.StringIO()):
                 config = Config()
                 assert config.workers == 2
@@ -24,26 +33,78 @@ class TestConfig:
     
     def test_config_file_size_conversion(self, test_config):
         """Test file size conversion from MB to bytes."""
-        with patch('yaml.safe_load', return_value=test_config):
+        with patch('yaml.load', return_value=test_config):
             with patch('builtins.open', return_value=io.StringIO()):
                 config = Config()
                 assert config.max_file_size == 10 * 1024 * 1024  # 10MB in bytes
+                assert config.max_mb_str == "10.0MB"
+    
+    def test_config_parse_is_cached(self, test_config):
+        """Test that an unchanged config file is parsed only once."""
+        with patch('yaml.load', return_value=test_config) as mock_load:
+            with patch('builtins.open', return_value=io.StringIO()):
+                Config()
+                config = Config()
+        
+        assert mock_load.call_count == 1
+        assert config.workers == 2
+    
+    def test_config_cache_invalidated_on_change(self, fake_fs, test_config, test_temp_dir):
+        """Test that editing the config file is picked up by the next Config()."""
+        config_path = os.path.join(test_temp_dir, "config.yaml")
+        changed_config = copy.deepcopy(test_config)
+        with open(config_path, 'w') as f:
+            yaml.safe_dump(test_config, f)
+        assert Config(config_path).workers == 2
+        
+        changed_config['converter']['workers'] = 12
+        with open(config_path, 'w') as f:
+            yaml.safe_dump(changed_config, f)
+        assert Config(config_path).workers == 12
+    
+    def test_config_json_sidecar(self, fake_fs, test_config, test_temp_dir, monkeypatch):
+        """Test that a JSON sidecar replaces the YAML parse until the file changes."""
+        config_path = os.path.join(test_temp_dir, "config.yaml")
+        cache_dir = os.path.join(test_temp_dir, "cache")
+        os.makedirs(cache_dir)
+        monkeypatch.setenv("CONFIG_CACHE_DIR", cache_dir)
+        with open(config_path, 'w') as f:
+            yaml.safe_dump(test_config, f)
+        
+        Config(config_path)
+        assert len(os.listdir(cache_dir)) == 1
+        
+        app_module._config_cache.clear()
+        with patch('yaml.load') as mock_load:
+            assert Config(config_path).workers == 2
+        mock_load.assert_not_called()
+        
+        changed_config = copy.deepcopy(test_config)
+        changed_config['converter']['workers'] = 3
+        with open(config_path, 'w') as f:
+            yaml.safe_dump(changed_config, f)
+        app_module._config_cache.clear()
+        assert Config(config_path).workers == 3
+    
+    def test_config_load_is_shared(self):
+        """Test that Config.load hands out one instance per path while Config() stays fresh."""
+        assert Config.load() is Config.load()
+        assert Config.load(os.environ["CONFIG_PATH"]) is app_module.config
+        assert Config() is not Config()
+    
+    def test_config_is_frozen(self, test_config):
+        """Test that parsed configuration is immutable."""
+        with patch('yaml.load', return_value=test_config):
+            with patch('builtins.open', return_value=io.StringIO()):
+                config = Config()
+                assert config.input_formats == tuple(test_config['converter']['input_formats'])
+                assert isinstance(config.input_formats_set, frozenset)
+                with pytest.raises(AttributeError):
+                    config.workers = 8
 
 class TestDocumentConverter:
     """Test document converter functionality."""
     
-    @pytest.fixture
-    def config(self, test_config):
-        """Provide test configuration."""
-        with patch('yaml.safe_load', return_value=test_config):
-            with patch('builtins.open', return_value=io.StringIO()):
-                return Config()
-    
-    @pytest.fixture
-    def converter(self, config):
-        """Provide document converter instance."""
-        return DocumentConverter(config)
-    
     def test_converter_initialization(self, converter):
         """Test converter initialization."""
         assert converter.config is not None
@@ -56,6 +117,16 @@ class TestDocumentConverter:
         assert converter._get_file_extension("test.PDF") == "pdf"
         assert converter._get_file_extension("document.xlsx") == "xlsx"
         assert converter._get_file_extension("no_extension") == ""
+        assert converter._get_file_extension(".hidden") == ""
+        assert converter._get_file_extension("reports.v2/summary") == ""
+    
+    def test_output_filename(self, converter):
+        """Test download name generation matches Path.stem."""
+        assert converter.output_filename("report.docx") == "report.pdf"
+        assert converter.output_filename("archive.tar.gz") == "archive.tar.pdf"
+        assert converter.output_filename("no_extension") == "no_extension.pdf"
+        assert converter.output_filename(".hidden") == ".hidden.pdf"
+        assert converter.output_filename("reports.v2/summary.odt") == "summary.pdf"
     
     def test_validate_input_format(self, converter):
         """Test input format validation."""
@@ -77,20 +148,159 @@ class TestDocumentConverter:
         assert output_file is None
     
     @pytest.mark.asyncio
-    async def test_convert_document_success(self, converter, mock_subprocess_success, temp_file):
+    async def test_convert_document_invalid_format_touches_nothing(self, converter):
+        """Test that an unsupported upload is rejected before any file or slot is used."""
+        existing = set(os.listdir(converter.config.temp_dir))
+        free_slots = converter.slot_q.qsize()
+        
+        with patch('pathlib.Path.write_bytes') as mock_write:
+            success, _, _ = await converter.convert_document(b"test content", "test.exe")
+        
+        assert success == False
+        mock_write.assert_not_called()
+        assert converter.slot_q.qsize() == free_slots
+        assert set(os.listdir(converter.config.temp_dir)) == existing
+    
+    @pytest.mark.asyncio
+    async def test_convert_document_success(self, converter, mock_subprocess_success):
         """Test successful document conversion."""
         content = b"test content"
         filename = "test.docx"
         
         # Mock the output file creation
-        with patch('pathlib.Path.glob') as mock_glob:
-            mock_glob.return_value = [Path(temp_file)]
-            
-            success, message, output_file = await converter.convert_document(content, filename)
-            
-            assert success == True
-            assert message == "Conversion successful"
-            assert output_file == temp_file
+        def fake_run(cmd, **kwargs):
+            output_dir = cmd[cmd.index('--outdir') + 1]
+            Path(output_dir, Path(cmd[-1]).stem + ".pdf").write_bytes(b"%PDF")
+            return mock_subprocess_success.return_value
+        mock_subprocess_success.side_effect = fake_run
+        
+        success, message, output_file = await converter.convert_document(content, filename)
+        
+        assert success == True
+        assert message == "Conversion successful"
+        assert output_file.endswith("_input.pdf")
+        assert os.path.exists(output_file)
+    
+    @pytest.mark.asyncio
+    async def test_convert_document_streams_upload(self, converter, mock_subprocess_success):
+        """Test that an upload spanning several stream chunks reaches disk intact."""
+        content = os.urandom(2 * app_module.STREAM_CHUNK + 123)
+        received = []
+        
+        def fake_run(cmd, **kwargs):
+            received.append(Path(cmd[-1]).read_bytes())
+            output_dir = cmd[cmd.index('--outdir') + 1]
+            Path(output_dir, Path(cmd[-1]).stem + ".pdf").write_bytes(b"%PDF")
+            return mock_subprocess_success.return_value
+        mock_subprocess_success.side_effect = fake_run
+        
+        upload = UploadFile(file=io.BytesIO(content), filename="big.docx")
+        success, _, output_file = await converter.convert_document(upload, upload.filename)
+        
+        assert success == True
+        assert received == [content]
+        await converter.release_slot(os.path.dirname(output_file))
+    
+    @pytest.mark.asyncio
+    async def test_convert_document_from_path(self, converter, mock_subprocess_success, temp_file):
+        """Test that a file already on disk is converted in place and left for the caller."""
+        def fake_run(cmd, **kwargs):
+            output_dir = cmd[cmd.index('--outdir') + 1]
+            Path(output_dir, Path(cmd[-1]).stem + ".pdf").write_bytes(b"%PDF")
+            return mock_subprocess_success.return_value
+        mock_subprocess_success.side_effect = fake_run
+        
+        success, _, output_file = await converter.convert_document(temp_file, "test.docx")
+        
+        assert success == True
+        assert mock_subprocess_success.call_args[0][0][-1] == temp_file
+        assert os.path.exists(temp_file)
+        await converter.release_slot(os.path.dirname(output_file))
+    
+    @pytest.mark.asyncio
+    async def test_convert_document_upload_too_large(self, converter, mock_subprocess_success):
+        """Test that an oversized upload is rejected while streaming to disk."""
+        upload = UploadFile(file=io.BytesIO(b"X" * (11 * 1024 * 1024)), filename="big.docx")
+        existing = set(os.listdir(converter.config.temp_dir))
+        
+        with pytest.raises(FileTooLargeError):
+            await converter.convert_document(upload, upload.filename)
+        
+        mock_subprocess_success.assert_not_called()
+        assert set(os.listdir(converter.config.temp_dir)) == existing
+    
+    @pytest.mark.asyncio
+    async def test_release_slot(self, converter, mock_subprocess_success):
+        """Test that an output slot is held until released, then emptied and reused."""
+        def fake_run(cmd, **kwargs):
+            output_dir = cmd[cmd.index('--outdir') + 1]
+            Path(output_dir, Path(cmd[-1]).stem + ".pdf").write_bytes(b"%PDF")
+            return mock_subprocess_success.return_value
+        mock_subprocess_success.side_effect = fake_run
+        free_slots = converter.slot_q.qsize()
+        
+        success, _, output_file = await converter.convert_document(b"test content", "test.docx")
+        
+        assert success == True
+        assert converter.slot_q.qsize() == free_slots - 1
+        
+        slot = os.path.dirname(output_file)
+        await converter.release_slot(slot)
+        
+        assert os.listdir(slot) == []
+        assert converter.slot_q.qsize() == free_slots
+    
+    @pytest.mark.asyncio
+    async def test_release_slot_removes_nested_entries(self, fake_fs, converter):
+        """Test that stray files and directories left in a slot do not survive its release."""
+        slot = await converter.slot_q.get()
+        os.makedirs(os.path.join(slot, "lock", "nested"))
+        Path(slot, "stray.tmp").write_bytes(b"x")
+        
+        await converter.release_slot(slot)
+        
+        assert os.listdir(slot) == []
+    
+    @pytest.mark.asyncio
+    async def test_release_slot_recreates_missing_slot(self, converter):
+        """Test that a slot whose directory vanished is recreated and still handed back."""
+        slot = await converter.slot_q.get()
+        shutil.rmtree(slot)
+        
+        await converter.release_slot(slot)
+        
+        assert os.path.isdir(slot)
+        assert converter.slot_q.qsize() == len(converter.slots)
+    
+    @pytest.mark.asyncio
+    async def test_release_slot_requeues_on_cleanup_error(self, converter):
+        """Test that a slot is handed back even when emptying it fails."""
+        slot = await converter.slot_q.get()
+        
+        with patch.object(converter, '_clear_slot', side_effect=PermissionError("busy")):
+            await converter.release_slot(slot)
+        
+        assert converter.slot_q.qsize() == len(converter.slots)
+    
+    @pytest.mark.asyncio
+    async def test_release_slot_ignores_foreign_directory(self, converter, temp_file):
+        """Test that releasing a directory that is not an output slot leaves it alone."""
+        free_slots = converter.slot_q.qsize()
+        
+        await converter.release_slot(os.path.dirname(temp_file))
+        
+        assert os.path.exists(temp_file)
+        assert converter.slot_q.qsize() == free_slots
+    
+    @pytest.mark.asyncio
+    async def test_convert_document_failure_releases_slot(self, converter, mock_subprocess_failure):
+        """Test that a failed conversion hands its output slot back."""
+        free_slots = converter.slot_q.qsize()
+        
+        success, _, _ = await converter.convert_document(b"test content", "test.docx")
+        
+        assert success == False
+        assert converter.slot_q.qsize() == free_slots
     
     @pytest.mark.asyncio
     async def test_convert_document_failure(self, converter, mock_subprocess_failure):
@@ -116,19 +326,98 @@ class TestDocumentConverter:
         assert "timeout" in message.lower()
         assert output_file is None
     
-    def test_run_libreoffice_conversion_success(self, converter, mock_subprocess_success, temp_file):
+    def test_run_libreoffice_conversion_success(self, converter, mock_subprocess_success, test_temp_dir):
         """Test LibreOffice conversion command execution."""
         input_path = "/tmp/test_input.docx"
-        output_dir = "/tmp/test_output"
+        output_dir = test_temp_dir
+        expected_output = os.path.join(output_dir, "test_input.pdf")
         
-        with patch('pathlib.Path.glob') as mock_glob:
-            mock_glob.return_value = [Path(temp_file)]
-            
-            success, message, output_file = converter._run_libreoffice_conversion(input_path, output_dir)
-            
-            assert success == True
-            assert message == "Conversion successful"
-            assert output_file == temp_file
+        # Output LibreOffice would have written for this input
+        with open(expected_output, 'wb') as f:
+            f.write(b"%PDF")
+        
+        success, message, output_file = converter._run_libreoffice_conversion(input_path, output_dir)
+        
+        assert success == True
+        assert message == "Conversion successful"
+        assert output_file == expected_output
+    
+    def test_run_libreoffice_conversion_leaves_environ_alone(self, converter, mock_subprocess_success):
+        """Test that conversions share one prebuilt environment and never touch os.environ."""
+        environ_before = dict(os.environ)
+        
+        converter._run_libreoffice_conversion("/tmp/test_input.docx", "/tmp/slot_0")
+        converter._run_libreoffice_conversion("/tmp/other_input.docx", "/tmp/slot_1")
+        
+        envs = [call.kwargs['env'] for call in mock_subprocess_success.call_args_list]
+        assert envs[0] is envs[1] is app_module.LIBREOFFICE_ENV
+        assert envs[0]['SAL_USE_VCLPLUGIN'] == 'svp'
+        assert dict(os.environ) == environ_before
+        with pytest.raises(TypeError):
+            app_module.LIBREOFFICE_ENV['DISPLAY'] = ':0'
+    
+    def test_run_libreoffice_conversion_uses_profile(self, converter, mock_subprocess_success):
+        """Test that a slot's LibreOffice profile is passed as the user installation."""
+        converter._run_libreoffice_conversion("/tmp/test_input.docx", "/tmp/slot_0", "/tmp/slot_0_profile")
+        
+        args = mock_subprocess_success.call_args[0][0]
+        assert "-env:UserInstallation=file:///tmp/slot_0_profile" in args
+        assert args[-1] == "/tmp/test_input.docx"
+    
+    def test_slot_profiles_seeded_from_template(self, fake_fs, test_config, test_temp_dir):
+        """Test that every output slot gets a copy of the profile template."""
+        template = os.path.join(test_temp_dir, "template")
+        os.makedirs(os.path.join(template, "user"))
+        seeded_config = copy.deepcopy(test_config)
+        seeded_config['converter']['temp_dir'] = os.path.join(test_temp_dir, "work")
+        seeded_config['converter']['profile_template'] = template
+        
+        with patch('yaml.load', return_value=seeded_config):
+            with patch('builtins.open', return_value=io.StringIO()):
+                converter = DocumentConverter(Config())
+        converter.start_slots()
+        
+        assert len(converter.slots) == converter.config.workers * 2
+        for slot in converter.slots:
+            assert os.path.isdir(os.path.join(app_module.slot_profile(slot), "user"))
+    
+    def test_converters_sharing_temp_dir_keep_their_slots(self, converter):
+        """Test that a second converter on the same temp_dir leaves the first one's output alone."""
+        slot = converter.slot_q.get_nowait()
+        output = Path(slot, "out.pdf")
+        output.write_bytes(b"%PDF")
+        
+        other = DocumentConverter(converter.config)
+        other.start_slots()
+        try:
+            assert other.slots.isdisjoint(converter.slots)
+            assert output.read_bytes() == b"%PDF"
+            other_root = other.slot_root
+        finally:
+            other.close()
+        
+        assert output.exists()
+        assert not os.path.exists(other_root)
+    
+    def test_close_removes_slots(self, converter):
+        """Test that closing a converter removes its slots, and starting again gives fresh ones."""
+        first_root = converter.slot_root
+        
+        converter.close()
+        assert not os.path.exists(first_root)
+        
+        converter.start_slots()
+        assert converter.slot_root != first_root
+        assert all(os.path.isdir(slot) for slot in converter.slots)
+        assert converter.slot_q.qsize() == len(converter.slots)
+    
+    def test_run_libreoffice_conversion_no_output(self, converter, mock_subprocess_success, test_temp_dir):
+        """Test that a zero exit code without the expected output is a failure."""
+        success, message, output_file = converter._run_libreoffice_conversion("/tmp/test_input.docx", test_temp_dir)
+        
+        assert success == False
+        assert message == "No output file generated"
+        assert output_file is None
     
     def test_run_libreoffice_conversion_failure(self, converter, mock_subprocess_failure):
         """Test LibreOffice conversion command failure."""
@@ -140,6 +429,85 @@ class TestDocumentConverter:
         assert success == False
         assert "LibreOffice error" in message
         assert output_file is None
+    
+    def test_start_soffice_pool_disabled(self, converter):
+        """Test that no soffice workers start unless enabled in config."""
+        converter.start_soffice_pool()
+        
+        assert converter.soffice_pool is None
+    
+    def test_soffice_pool_seeds_worker_profiles(self, fake_fs, test_config, test_temp_dir):
+        """Test that persistent soffice workers start from copies of the profile template."""
+        template = os.path.join(test_temp_dir, "template")
+        os.makedirs(os.path.join(template, "user"))
+        pool_config = copy.deepcopy(test_config)
+        pool_config['converter']['temp_dir'] = os.path.join(test_temp_dir, "work")
+        pool_config['converter']['profile_template'] = template
+        
+        with patch('yaml.load', return_value=pool_config):
+            with patch('builtins.open', return_value=io.StringIO()):
+                pool = app_module.SofficePool(Config())
+        
+        with patch.object(app_module.SofficeWorker, 'start'), patch.object(app_module.SofficeWorker, 'connect'):
+            pool.start()
+        
+        for worker in pool.workers:
+            assert os.path.isdir(os.path.join(worker.profile_dir, "user"))
+    
+    def test_run_libreoffice_conversion_uses_soffice_pool(self, converter, mock_subprocess_success):
+        """Test that a running soffice pool handles the conversion."""
+        converter.soffice_pool = MagicMock()
+        converter.soffice_pool.convert.return_value = (True, "Conversion successful", "/tmp/test_output/test.pdf")
+        
+        success, message, output_file = converter._run_libreoffice_conversion("/tmp/test.docx", "/tmp/test_output")
+        
+        assert success == True
+        assert output_file == "/tmp/test_output/test.pdf"
+        mock_subprocess_success.assert_not_called()
+    
+    def test_run_libreoffice_conversion_soffice_pool_fallback(self, converter, mock_subprocess_failure):
+        """Test fallback to a one-off LibreOffice process when the pool fails."""
+        converter.soffice_pool = MagicMock()
+        converter.soffice_pool.convert.return_value = (False, "soffice worker error: disposed", None)
+        
+        success, message, output_file = converter._run_libreoffice_conversion("/tmp/test.docx", "/tmp/test_output")
+        
+        mock_subprocess_failure.assert_called_once()
+        assert success == False
+        assert "LibreOffice error" in message
+
+    def test_run_libreoffice_conversion_soffice_pool_timeout(self, converter, mock_subprocess_success):
+        """Test that a soffice timeout is reported without retrying in a one-off process."""
+        converter.soffice_pool = MagicMock()
+        converter.soffice_pool.convert.return_value = (False, "Conversion timeout", None)
+        
+        success, message, output_file = converter._run_libreoffice_conversion("/tmp/test.docx", "/tmp/test_output")
+        
+        mock_subprocess_success.assert_not_called()
+        assert success == False
+        assert message == "Conversion timeout"
+    
+    def test_soffice_worker_killed_on_timeout(self):
+        """Test that a hung soffice conversion is killed and reported as a timeout."""
+        killed = threading.Event()
+        worker = app_module.SofficeWorker(2002, "/tmp/profile")
+        worker.process = MagicMock()
+        worker.process.poll.return_value = None
+        worker.process.kill.side_effect = killed.set
+        worker._desktop = MagicMock()
+        
+        def hang(*args):
+            killed.wait(5)
+            raise RuntimeError("Binary URP bridge disposed during call")
+        
+        worker._desktop.loadComponentFromURL.side_effect = hang
+        
+        with patch.object(app_module, 'uno', MagicMock()), patch.object(app_module, '_uno_properties'):
+            with pytest.raises(TimeoutError):
+                worker.convert("/tmp/test.docx", "/tmp/test.pdf", 0.05)
+        
+        worker.process.kill.assert_called_once()
+        assert worker._desktop is None
 
 class TestAPIEndpoints:
     """Test FastAPI endpoints."""
@@ -176,13 +544,49 @@ class TestAPIEndpoints:
     
     def test_convert_large_file(self, client, large_file_content):
         """Test conversion with file too large."""
-        response = client.post(
-            "/convert",
-            files={"file": ("large_file.docx", large_file_content, "application/vnd.openxmlformats-officedocument.wordprocessingml.document")}
-        )
+        # Apply the 10MB test limit the fixture content is sized against
+        limited = copy.copy(app_module.config)
+        object.__setattr__(limited, 'max_file_size', 10 * 1024 * 1024)
+        object.__setattr__(limited, 'max_mb_str', "10.0MB")
+        
+        with patch.object(app_module, 'config', limited), patch.object(app_module.converter, 'config', limited):
+            response = client.post(
+                "/convert",
+                files={"file": ("large_file.docx", large_file_content, "application/vnd.openxmlformats-officedocument.wordprocessingml.document")}
+            )
         assert response.status_code == 413  # File too large
         assert "too large" in response.json()["detail"]
     
+    def test_convert_returns_output_file(self, client, small_file_content, temp_file):
+        """Test that the converted file is streamed back with its stat-derived headers."""
+        convert = AsyncMock(return_value=(True, "Conversion successful", temp_file))
+        
+        with patch.object(app_module.converter, 'convert_document', new=convert):
+            response = client.post(
+                "/convert",
+                files={"file": ("report.docx", small_file_content, "application/vnd.openxmlformats-officedocument.wordprocessingml.document")}
+            )
+        
+        assert response.status_code == 200
+        assert response.content == b"Test content"
+        assert response.headers["content-length"] == str(os.path.getsize(temp_file))
+        assert 'filename="report.pdf"' in response.headers["content-disposition"]
+    
+    def test_convert_declared_length_too_large(self, client, small_file_content):
+        """Test that an oversized Content-Length is rejected before the body is parsed."""
+        declared = str(app_module.config.max_file_size + 1)
+        
+        with patch.object(app_module.converter, 'convert_document') as mock_convert:
+            response = client.post(
+                "/convert",
+                files={"file": ("test.docx", small_file_content, "application/vnd.openxmlformats-officedocument.wordprocessingml.document")},
+                headers={"Content-Length": declared}
+            )
+        
+        assert response.status_code == 413
+        assert "too large" in response.json()["detail"]
+        mock_convert.assert_not_called()
+    
     def test_convert_no_filename(self, client, small_file_content):
         """Test conversion without filename."""
         response = client.post(
@@ -192,13 +596,11 @@ class TestAPIEndpoints:
         assert response.status_code == 400
         assert "filename" in response.json()["detail"]
     
-    @patch('app.converter.convert_document')
+    @patch('app.converter.convert_document', new_callable=AsyncMock)
     def test_convert_success(self, mock_convert, client, small_file_content, temp_file):
         """Test successful conversion."""
         # Mock successful conversion
-        mock_convert.return_value = asyncio.coroutine(
-            lambda: (True, "Conversion successful", temp_file)
-        )()
+        mock_convert.return_value = (True, "Conversion successful", temp_file)
         
         # Create temp file with content
         with open(temp_file, 'wb') as f:
@@ -213,13 +615,11 @@ class TestAPIEndpoints:
         assert response.headers["content-type"] == "application/octet-stream"
         assert "attachment" in response.headers["content-disposition"]
     
-    @patch('app.converter.convert_document')
+    @patch('app.converter.convert_document', new_callable=AsyncMock)
     def test_convert_failure(self, mock_convert, client, small_file_content):
         """Test failed conversion."""
         # Mock failed conversion
-        mock_convert.return_value = asyncio.coroutine(
-            lambda: (False, "Conversion failed", None)
-        )()
+        mock_convert.return_value = (False, "Conversion failed", None)
         
         response = client.post(
             "/convert",
@@ -243,13 +643,11 @@ class TestAPIEndpoints:
         assert response.status_code == 400
         assert "Too many files" in response.json()["detail"]
     
-    @patch('app.converter.convert_document')
+    @patch('app.converter.convert_document', new_callable=AsyncMock)
     def test_convert_batch_success(self, mock_convert, client, small_file_content):
         """Test successful batch conversion."""
         # Mock successful conversion
-        mock_convert.return_value = asyncio.coroutine(
-            lambda: (True, "Conversion successful", "/tmp/output.pdf")
-        )()
+        mock_convert.return_value = (True, "Conversion successful", "/tmp/output.pdf")
         
         files = [
             ("files", ("test1.docx", small_file_content, "application/vnd.openxmlformats-officedocument.wordprocessingml.document")),
@@ -264,7 +662,7 @@ class TestAPIEndpoints:
         assert len(data["results"]) == 2
         assert all(result["success"] for result in data["results"])
     
-    @patch('app.converter.convert_document')
+    @patch('app.converter.convert_document', new_callable=AsyncMock)
     def test_convert_batch_mixed_results(self, mock_convert, client, small_file_content):
         """Test batch conversion with mixed results."""
         # Mock mixed results
@@ -273,10 +671,7 @@ class TestAPIEndpoints:
             (False, "Conversion failed", None),
         ]
         
-        mock_convert.side_effect = [
-            asyncio.coroutine(lambda: results[0])(),
-            asyncio.coroutine(lambda: results[1])(),
-        ]
+        mock_convert.side_effect = results
         
         files = [
             ("files", ("test1.docx", small_file_content, "application/vnd.openxmlformats-officedocument.wordprocessingml.document")),
@@ -292,72 +687,50 @@ class TestAPIEndpoints:
         assert data["results"][0]["success"] == True
         assert data["results"][1]["success"] == False
 
-class TestUtilityFunctions:
-    """Test utility functions."""
-    
-    @pytest.mark.asyncio
-    async def test_cleanup_file(self, temp_file):
-        """Test file cleanup function."""
-        from app import cleanup_file
+    def test_convert_batch_runs_in_parallel(self, client, small_file_content):
+        """Test that batch conversions are in flight at the same time."""
+        in_flight = 0
+        peak = 0
+        
+        async def fake_convert(source, filename):
+            nonlocal in_flight, peak
+            in_flight += 1
+            peak = max(peak, in_flight)
+            await asyncio.sleep(0.05)
+            in_flight -= 1
+            return True, "Conversion successful", None
         
-        # Ensure file exists
-        assert os.path.exists(temp_file)
+        files = [
+            ("files", (f"test{i}.docx", small_file_content, "application/vnd.openxmlformats-officedocument.wordprocessingml.document"))
+            for i in range(3)
+        ]
         
-        # Cleanup file
-        await cleanup_file(temp_file)
+        with patch('app.converter.convert_document', new=fake_convert):
+            response = client.post("/convert/batch", files=files)
         
-        # File should be removed
-        assert not os.path.exists(temp_file)
-    
-    @pytest.mark.asyncio
-    async def test_cleanup_file_nonexistent(self):
-        """Test cleanup of non-existent file."""
-        from app import cleanup_file
-        
-        # Try to cleanup non-existent file (should not raise error)
-        await cleanup_file("/tmp/nonexistent_file.txt")
+        assert response.status_code == 200
+        assert [result["filename"] for result in response.json()["results"]] == ["test0.docx", "test1.docx", "test2.docx"]
+        assert peak == 3
     
-    @pytest.mark.asyncio
-    async def test_cleanup_dir(self, test_temp_dir):
-        """Test directory cleanup function."""
-        from app import cleanup_dir
-        
-        # Create empty directory
-        test_dir = os.path.join(test_temp_dir, "test_cleanup")
-        os.makedirs(test_dir, exist_ok=True)
+    def test_convert_batch_file_too_large(self, client, test_config, small_file_content, large_file_content):
+        """Test that the size limit is enforced per file while uploads stream concurrently."""
+        with patch('yaml.load', return_value=test_config):
+            with patch('builtins.open', return_value=io.StringIO()):
+                limited_config = Config()
         
-        # Ensure directory exists and is empty
-        assert os.path.exists(test_dir)
-        assert os.path.isdir(test_dir)
-        assert len(os.listdir(test_dir)) == 0
+        files = [
+            ("files", ("large.docx", large_file_content, "application/vnd.openxmlformats-officedocument.wordprocessingml.document")),
+            ("files", ("test.exe", small_file_content, "application/octet-stream")),
+        ]
         
-        # Cleanup directory
-        await cleanup_dir(test_dir)
+        with patch.object(app_module.converter, 'config', limited_config):
+            response = client.post("/convert/batch", files=files)
         
-        # Directory should be removed
-        assert not os.path.exists(test_dir)
-    
-    @pytest.mark.asyncio
-    async def test_cleanup_dir_with_files(self, test_temp_dir):
-        """Test directory cleanup with files (should not remove)."""
-        from app import cleanup_dir
-        
-        # Create directory with file
-        test_dir = os.path.join(test_temp_dir, "test_cleanup_with_files")
-        os.makedirs(test_dir, exist_ok=True)
-        test_file = os.path.join(test_dir, "test.txt")
-        with open(test_file, 'w') as f:
-            f.write("test")
-        
-        # Ensure directory exists and has files
-        assert os.path.exists(test_dir)
-        assert len(os.listdir(test_dir)) == 1
-        
-        # Try to cleanup directory (should not remove because it has files)
-        await cleanup_dir(test_dir)
-        
-        # Directory should still exist
-        assert os.path.exists(test_dir)
+        assert response.status_code == 200
+        results = response.json()["results"]
+        assert results[0]["success"] == False
+        assert "too large" in results[0]["message"]
+        assert "Unsupported input format" in results[1]["message"]
 
 class TestErrorHandling:
     """Test error handling scenarios."""
@@ -368,7 +741,7 @@ class TestErrorHandling:
         content = b"test content"
         filename = "test.docx"
         
-        with patch('aiofiles.open', side_effect=Exception("Disk full")):
+        with patch('pathlib.Path.write_bytes', side_effect=Exception("Disk full")):
             success, message, output_file = await converter.convert_document(content, filename)
             
             assert success == False
@@ -391,7 +764,7 @@ class TestErrorHandling:
             mock_run.assert_called_once()
             args = mock_run.call_args[0][0]
             
-            assert 'libreoffice' in args
+            assert 'libreoffice' in args[0]
             assert '--headless' in args
             assert '--invisible' in args
             assert '--nodefault' in args
@@ -429,27 +802,64 @@ class TestPerformance:
     async def test_concurrent_conversions(self, converter):
         """Test multiple concurrent conversions."""
         content = b"test content"
-        filenames = [f"test{i}.docx" for i in range(5)]
+        # More conversions than output slots, so some wait for a slot to be released
+        filenames = [f"test{i}.docx" for i in range(len(converter.slots) + 1)]
+        
+        async def convert_and_release(filename):
+            result = await converter.convert_document(content, filename)
+            await converter.release_slot(os.path.dirname(result[2]))
+            return result
         
         with patch.object(converter, '_run_libreoffice_conversion') as mock_convert:
-            mock_convert.return_value = (True, "Conversion successful", "/tmp/output.pdf")
+            mock_convert.side_effect = lambda input_path, output_dir, profile_dir: (
+                True, "Conversion successful", os.path.join(output_dir, "output.pdf")
+            )
             
             # Run concurrent conversions
-            tasks = [
-                converter.convert_document(content, filename)
-                for filename in filenames
-            ]
+            tasks = [convert_and_release(filename) for filename in filenames]
             
             results = await asyncio.gather(*tasks)
             
             # All conversions should succeed
             assert all(result[0] for result in results)
-            assert len(results) == 5
+            assert len(results) == len(filenames)
     
     def test_thread_pool_initialization(self, converter):
         """Test that thread pool is initialized correctly."""
         assert converter.executor is not None
         assert converter.executor._max_workers == converter.config.workers
+    
+    def test_construction_touches_no_files(self, fake_fs, test_config, test_temp_dir):
+        """Test that building a converter (as importing app does) leaves the filesystem alone."""
+        lazy_config = copy.deepcopy(test_config)
+        lazy_config['converter']['temp_dir'] = os.path.join(test_temp_dir, "work")
+        
+        with patch('yaml.load', return_value=lazy_config):
+            with patch('builtins.open', return_value=io.StringIO()):
+                converter = DocumentConverter(Config())
+        
+        assert not os.path.exists(converter.config.temp_dir)
+        converter.start_slots()
+        assert os.path.isdir(converter.config.temp_dir)
+    
+    def test_process_pool_initialization(self, test_config):
+        """Test that executor_type: process uses a process pool."""
+        process_config = copy.deepcopy(test_config)
+        process_config['converter']['executor_type'] = 'process'
+        
+        with patch('yaml.load', return_value=process_config):
+            with patch('builtins.open', return_value=io.StringIO()):
+                converter = DocumentConverter(Config())
+        
+        try:
+            assert isinstance(converter.executor, ProcessPoolExecutor)
+            assert converter.executor._max_workers == 2
+            
+            # Workers are spawned at startup rather than on the first request
+            converter.start_worker_processes()
+            assert len(converter.executor._processes) == 2
+        finally:
+            converter.executor.shutdown()
 
 class TestConfigValidation:
     """Test configuration validation and edge cases."""
@@ -463,11 +873,73 @@ class TestConfigValidation:
             }
         }
         
-        with patch('yaml.safe_load', return_value=incomplete_config):
+        with patch('yaml.load', return_value=incomplete_config):
             with patch('builtins.open', return_value=io.StringIO()):
                 with pytest.raises(KeyError):
                     Config()
     
+    def test_config_invalid_executor_type(self, test_config):
+        """Test that an unknown executor_type is rejected."""
+        bad_config = copy.deepcopy(test_config)
+        bad_config['converter']['executor_type'] = 'fiber'
+        
+        with patch('yaml.load', return_value=bad_config):
+            with patch('builtins.open', return_value=io.StringIO()):
+                with pytest.raises(ValueError):
+                    Config()
+    
+    def test_config_prefer_tmpfs(self, fake_fs, test_config):
+        """Test that prefer_tmpfs moves temp files to a private directory on /dev/shm when it has room."""
+        fake_fs.create_dir(app_module.TMPFS_ROOT)
+        tmpfs_config = copy.deepcopy(test_config)
+        tmpfs_config['converter']['prefer_tmpfs'] = True
+        roomy = MagicMock(f_bavail=1024 * 1024, f_frsize=4096)
+        
+        with patch('yaml.load', return_value=tmpfs_config):
+            with patch('builtins.open', return_value=io.StringIO()):
+                with patch('os.statvfs', return_value=roomy):
+                    config = Config()
+        
+        assert config.temp_dir == app_module.tmpfs_temp_dir(test_config['converter']['temp_dir'])
+        assert config.temp_dir.startswith("/dev/shm/")
+        st = os.lstat(config.temp_dir)
+        assert stat.S_IMODE(st.st_mode) == 0o700
+        assert st.st_uid == os.getuid()
+    
+    def test_private_tmpfs_dir_rejects_planted_entries(self, fake_fs):
+        """Test that a symlink or a loosely permitted directory at the tmpfs path is never used."""
+        fake_fs.create_dir(app_module.TMPFS_ROOT)
+        linked = app_module.tmpfs_temp_dir("/tmp/linked")
+        fake_fs.create_dir("/tmp/elsewhere")
+        os.symlink("/tmp/elsewhere", linked)
+        shared = app_module.tmpfs_temp_dir("/tmp/shared")
+        os.mkdir(shared, 0o777)
+        os.chmod(shared, 0o777)
+        
+        for configured, planted in (("/tmp/linked", linked), ("/tmp/shared", shared)):
+            temp_dir = app_module.private_tmpfs_dir(configured)
+            assert temp_dir != planted
+            assert os.path.dirname(temp_dir) == app_module.TMPFS_ROOT
+            assert stat.S_IMODE(os.lstat(temp_dir).st_mode) == 0o700
+    
+    def test_tmpfs_temp_dir_follows_configured_path(self):
+        """Test that differently configured temp_dirs never share a tmpfs directory."""
+        assert app_module.tmpfs_temp_dir("/tmp/a") == app_module.tmpfs_temp_dir("/tmp/a")
+        assert app_module.tmpfs_temp_dir("/tmp/a") != app_module.tmpfs_temp_dir("/tmp/b")
+    
+    def test_config_prefer_tmpfs_insufficient_space(self, test_config):
+        """Test that the configured temp_dir is kept when tmpfs is too small."""
+        tmpfs_config = copy.deepcopy(test_config)
+        tmpfs_config['converter']['prefer_tmpfs'] = True
+        cramped = MagicMock(f_bavail=1, f_frsize=4096)
+        
+        with patch('yaml.load', return_value=tmpfs_config):
+            with patch('builtins.open', return_value=io.StringIO()):
+                with patch('os.statvfs', return_value=cramped):
+                    config = Config()
+        
+        assert config.temp_dir == test_config['converter']['temp_dir']
+    
     def test_config_file_not_found(self):
         """Test handling of missing config file."""
         with pytest.raises(FileNotFoundError):
@@ -527,7 +999,7 @@ class TestUnitIsolation:
     
     def test_converter_instance_isolation(self, test_config):
         """Test that converter instances don't interfere with each other."""
-        with patch('yaml.safe_load', return_value=test_config):
+        with patch('yaml.load', return_value=test_config):
             with patch('builtins.open', return_value=io.StringIO()):
                 config1 = Config()
                 config2 = Config()
@@ -1,45 +1,86 @@
 import pytest
 import asyncio
+import functools
+import math
 import os
 import tempfile
 import time
 from pathlib import Path
-from typing import List, Tuple
+from typing import List, Optional, Tuple
 import subprocess
 import shutil
-from fastapi.testclient import TestClient
-from httpx import AsyncClient
-import requests
+import statistics
+from unittest.mock import patch
+import httpx
 
-from app import app, Config, DocumentConverter
+from app import app, config, converter, Config, DocumentConverter
+
+# libreoffice on $PATH, looked up once for the whole module
+_LIBREOFFICE_PATH = shutil.which('libreoffice')
+
+@functools.lru_cache(maxsize=1)
+def check_libreoffice_installation() -> bool:
+    """Check if LibreOffice is properly installed (probed once per session)."""
+    if _LIBREOFFICE_PATH is None:
+        return False
+    try:
+        result = subprocess.run(
+            [_LIBREOFFICE_PATH, '--version'],
+            capture_output=True,
+            timeout=10
+        )
+        return result.returncode == 0 and b'LibreOffice' in result.stdout
+    except (FileNotFoundError, subprocess.TimeoutExpired):
+        return False
+
+LO_AVAILABLE = check_libreoffice_installation()
+
+# Every test here drives a real LibreOffice, so the module is skipped without one
+pytestmark = pytest.mark.skipif(not LO_AVAILABLE, reason="LibreOffice not available for integration tests")
+
+# Seconds one conversion of a small document may take on a warm worker
+CONVERSION_BUDGET_S = 6
+
+# Keys every /convert/batch result carries
+RESULT_KEYS = frozenset(("filename", "success", "message"))
+
+# Bulk ASCII content for the disk space test, encoded once
+_SPACE_PAYLOAD = b"Test file with some content to take up space" * 100
+
+@pytest.fixture(scope="module", autouse=True)
+def warm_libreoffice(client):
+    """Convert once in every output slot up front, so timed tests never pay LibreOffice's cold start.
+    
+    Goes through the started app, so with soffice_daemon the persistent workers warm up too.
+    """
+    files = [
+        ("files", (f"warm{i}.txt", b"warm", "text/plain"))
+        for i in range(len(converter.slots))
+    ]
+    client.post("/convert/batch", files=files)
 
 @pytest.mark.integration
 class TestIntegrationBasic:
     """Basic integration tests for the document converter."""
     
     @pytest.fixture
-    def real_config(self):
+    def real_config(self, test_config_path):
         """Provide real configuration for integration tests."""
-        return Config("config-test.yaml")
+        return Config(test_config_path)
     
     @pytest.fixture
     def real_converter(self, real_config):
         """Provide real converter instance."""
-        return DocumentConverter(real_config)
+        converter = DocumentConverter(real_config)
+        converter.start_slots()
+        yield converter
+        converter.close()
     
     def test_libreoffice_available(self):
         """Test that LibreOffice is available in the system."""
-        try:
-            result = subprocess.run(
-                ['libreoffice', '--version'],
-                capture_output=True,
-                text=True,
-                timeout=10
-            )
-            assert result.returncode == 0
-            assert 'LibreOffice' in result.stdout
-        except FileNotFoundError:
+        if _LIBREOFFICE_PATH is None:
             pytest.skip("LibreOffice not available in test environment")
+        assert LO_AVAILABLE
     
     def test_temp_directory_creation(self, real_converter):
         """Test that temporary directories are created correctly."""
@@ -51,14 +92,11 @@ class TestIntegrationBasic:
     async def test_text_to_pdf_conversion(self, real_converter, create_test_files):
         """Test actual text to PDF conversion."""
         # Skip if LibreOffice not available
-        if not shutil.which('libreoffice'):
+        if _LIBREOFFICE_PATH is None:
             pytest.skip("LibreOffice not available")
         
-        # Create test text file
-        text_content = "This is a test document for conversion.\nSecond line.\nThird line."
-        
         success, message, output_file = await real_converter.convert_document(
-            text_content.encode('utf-8'), 
+            create_test_files["test_text.txt"],
             "test.txt"
         )
         
@@ -75,20 +113,10 @@ class TestIntegrationBasic:
             print(f"Conversion failed: {message}")
 
 @pytest.mark.integration
+@pytest.mark.xdist_group("temp_dir")
 class TestIntegrationAPI:
     """Integration tests for the API endpoints."""
     
-    @pytest.fixture
-    def client(self):
-        """Provide test client."""
-        return TestClient(app)
-    
-    @pytest.fixture
-    async def async_client(self):
-        """Provide async test client."""
-        async with AsyncClient(app=app, base_url="http://test") as ac:
-            yield ac
-    
     def test_api_health_check(self, client):
         """Test API health check endpoint."""
         response = client.get("/health")
@@ -103,8 +131,7 @@ class TestIntegrationAPI:
         assert response.status_code == 200
         data = response.json()
         
-        assert "input_formats" in data
-        assert "output_format" in data
+        assert {"input_formats", "output_format"}.issubset(data)
         assert isinstance(data["input_formats"], list)
         assert len(data["input_formats"]) > 0
         assert "docx" in data["input_formats"]
@@ -114,14 +141,12 @@ class TestIntegrationAPI:
     def test_api_convert_with_real_text_file(self, client, create_test_files):
         """Test conversion with real text file through API."""
         # Skip if LibreOffice not available
-        if not shutil.which('libreoffice'):
+        if _LIBREOFFICE_PATH is None:
             pytest.skip("LibreOffice not available")
         
-        test_content = "Integration test document content.\nLine 2\nLine 3"
-        
         response = client.post(
             "/convert",
-            files={"file": ("test_integration.txt", test_content.encode('utf-8'), "text/plain")}
+            files={"file": ("test_integration.txt", create_test_files["test_text.txt"], "text/plain")}
         )
         
         # Should either succeed or fail gracefully
@@ -140,7 +165,7 @@ class TestIntegrationAPI:
         )
         
         assert response.status_code == 400
-        assert "Unsupported input format" in response.json()["detail"]
+        assert b"Unsupported input format" in response.content
     
     def test_api_convert_no_filename(self, client):
         """Test conversion without filename."""
@@ -149,8 +174,10 @@ class TestIntegrationAPI:
             files={"file": (None, b"content", "text/plain")}
         )
         
-        assert response.status_code == 400
-        assert "filename" in response.json()["detail"]
+        # A part without a filename is parsed as a plain form field, so
+        # validation rejects it before the handler's own filename check
+        assert response.status_code == 422
+        assert response.json()["detail"][0]["loc"] == ["body", "file"]
     
     def test_api_batch_conversion(self, client):
         """Test batch conversion endpoint."""
@@ -166,42 +193,55 @@ class TestIntegrationAPI:
         assert "results" in data
         assert len(data["results"]) == 2
         
-        for result in data["results"]:
-            assert "filename" in result
-            assert "success" in result
-            assert "message" in result
+        assert all(RESULT_KEYS.issubset(result) for result in data["results"])
+        
+        # Conversions run concurrently but results keep the upload order
+        assert [result["filename"] for result in data["results"]] == ["test1.txt", "test2.txt"]
 
 @pytest.mark.integration
+@pytest.mark.xdist_group("temp_dir")
 class TestIntegrationPerformance:
     """Integration tests for performance and concurrency."""
     
-    @pytest.fixture
-    def client(self):
-        """Provide test client."""
-        return TestClient(app)
-    
     @pytest.mark.slow
-    def test_concurrent_requests(self, client):
+    @pytest.mark.asyncio(loop_scope="module")
+    async def test_concurrent_requests(self, async_client):
         """Test multiple concurrent API requests."""
-        def make_request(content: str) -> Tuple[int, dict]:
-            response = client.post(
-                "/convert",
-                files={"file": (f"test_{content}.txt", content.encode('utf-8'), "text/plain")}
-            )
-            return response.status_code, response.json() if response.status_code != 200 else {}
+        # Bounds how many requests are in flight at once
+        semaphore = asyncio.Semaphore(3)
+        
+        latencies_ms = []
+        
+        async def make_request(content: bytes) -> Tuple[int, bytes]:
+            async with semaphore:
+                start_ns = time.perf_counter_ns()
+                # Streamed so a converted document is never buffered; only
+                # the start of an error body is kept
+                async with async_client.stream(
+                    "POST",
+                    "/convert",
+                    files={"file": (f"test_{content.decode()}.txt", content, "text/plain")}
+                ) as response:
+                    error = (await response.aread())[:512] if response.status_code != 200 else b""
+                latencies_ms.append((time.perf_counter_ns() - start_ns) / 1e6)
+                return response.status_code, error
         
         # Create multiple requests
-        contents = [f"Test content {i}" for i in range(5)]
+        contents = [f"Test content {i}".encode('utf-8') for i in range(5)]
         
-        # Execute requests concurrently using ThreadPoolExecutor
-        from concurrent.futures import ThreadPoolExecutor
-        with ThreadPoolExecutor(max_workers=3) as executor:
-            futures = [executor.submit(make_request, content) for content in contents]
-            results = [future.result() for future in futures]
+        # Execute requests concurrently on the app's event loop, collecting
+        # each result as soon as it finishes
+        results = []
+        for done in asyncio.as_completed([make_request(content) for content in contents]):
+            results.append(await done)
         
         # All requests should complete
         assert len(results) == 5
         
+        # Each request, once admitted, converts on a warm worker
+        p95 = statistics.quantiles(latencies_ms, n=100, method='inclusive')[94]
+        assert p95 < CONVERSION_BUDGET_S * 1000, f"p95 latency {p95:.0f}ms"
+        
         # Check that we don't have too many failures
         success_count = sum(1 for status, _ in results if status == 200)
         error_count = len(results) - success_count
@@ -211,54 +251,64 @@ class TestIntegrationPerformance:
     
     @pytest.mark.slow
     def test_large_batch_conversion(self, client):
-        """Test batch conversion with multiple files."""
+        """Test that a batch converts in parallel, one round per worker pool's worth of files."""
         files = [
             ("files", (f"test{i}.txt", f"Content for file {i}".encode('utf-8'), "text/plain"))
             for i in range(4)  # Test with 4 files (within limit)
         ]
         
-        start_time = time.time()
+        start_ns = time.perf_counter_ns()
         response = client.post("/convert/batch", files=files)
-        end_time = time.time()
+        elapsed_s = (time.perf_counter_ns() - start_ns) / 1e9
         
         assert response.status_code == 200
         data = response.json()
         assert len(data["results"]) == 4
         
-        # Should complete within reasonable time
-        assert end_time - start_time < 60  # 60 seconds max
+        # Files convert concurrently, so the batch takes about as long as
+        # one conversion per round of workers
+        rounds = math.ceil(len(files) / config.workers)
+        assert elapsed_s < max(5, rounds * CONVERSION_BUDGET_S)
     
     def test_file_size_limits(self, client):
-        """Test file size limit enforcement."""
-        # Create content larger than limit (test config has 10MB limit)
-        large_content = b"X" * (15 * 1024 * 1024)  # 15MB
+        """Test file size limit enforcement without materializing the oversized body."""
+        size = config.max_file_size + 1
+        sent = []
+        
+        def body():
+            # Only produced if the server reads past the headers
+            chunk = b"X" * (1024 * 1024)
+            for offset in range(0, size, len(chunk)):
+                sent.append(offset)
+                yield chunk[:size - offset]
         
         response = client.post(
             "/convert",
-            files={"file": ("large.txt", large_content, "text/plain")}
+            content=body(),
+            headers={
+                "Content-Length": str(size),
+                "Content-Type": "multipart/form-data; boundary=size-limit-test"
+            }
         )
         
         assert response.status_code == 413
         assert "too large" in response.json()["detail"]
+        assert sent == []
 
 @pytest.mark.integration
 class TestIntegrationDocker:
     """Integration tests for Docker-specific functionality."""
     
-    def test_environment_variables(self):
+    def test_environment_variables(self, test_config_path):
         """Test that required environment variables are set correctly."""
         # These should be set in the Docker environment
         display_var = os.environ.get('DISPLAY', '')
         sal_plugin = os.environ.get('SAL_USE_VCLPLUGIN', '')
         
         # In test environment, these might not be set, so we test the application sets them
-        from app import DocumentConverter, Config
-        converter = DocumentConverter(Config("config-test.yaml"))
+        converter = DocumentConverter(Config(test_config_path))
         
         # Test that the converter sets the environment correctly in subprocess
-        import subprocess
-        from unittest.mock import patch
-        
         with patch('subprocess.run') as mock_run:
             mock_run.return_value.returncode = 0
             mock_run.return_value.stderr = ""
@@ -271,13 +321,13 @@ class TestIntegrationDocker:
             assert env['DISPLAY'] == ''
             assert env['SAL_USE_VCLPLUGIN'] == 'svp'
     
-    def test_temp_directory_permissions(self):
+    def test_temp_directory_permissions(self, test_config_path):
         """Test that temporary directory has correct permissions."""
-        from app import DocumentConverter, Config
-        converter = DocumentConverter(Config("config-test.yaml"))
+        converter = DocumentConverter(Config(test_config_path))
+        converter.start_slots()
         
         temp_dir = converter.config.temp_dir
-        if os.path.exists(temp_dir):
+        try:
             # Check that directory is writable
             test_file = os.path.join(temp_dir, "test_permissions.txt")
             try:
@@ -288,16 +338,14 @@ class TestIntegrationDocker:
                 assert True
             except PermissionError:
                 pytest.fail("Temporary directory is not writable")
+        finally:
+            converter.close()
 
 @pytest.mark.integration
+@pytest.mark.xdist_group("temp_dir")
 class TestIntegrationErrorHandling:
     """Integration tests for error handling scenarios."""
     
-    @pytest.fixture
-    def client(self):
-        """Provide test client."""
-        return TestClient(app)
-    
     def test_malformed_file_handling(self, client):
         """Test handling of malformed files."""
         # Create a file with wrong extension but different content
@@ -320,17 +368,13 @@ class TestIntegrationErrorHandling:
         # This test depends on the timeout configuration
         # We can't easily force a timeout in integration tests,
         # so we just verify the timeout setting exists
-        from app import config
         assert config.conversion_timeout > 0
         assert config.conversion_timeout <= 300  # Reasonable upper bound
     
     def test_disk_space_simulation(self, client):
         """Test behavior when disk space might be limited."""
         # Create multiple files to potentially fill up space
-        files = []
-        for i in range(10):
-            content = f"Test file {i} with some content to take up space" * 100
-            files.append(("files", (f"test{i}.txt", content.encode('utf-8'), "text/plain")))
+        files = [("files", (f"test{i}.txt", _SPACE_PAYLOAD, "text/plain")) for i in range(10)]
         
         response = client.post("/convert/batch", files=files)
         
@@ -338,21 +382,24 @@ class TestIntegrationErrorHandling:
         assert response.status_code in [200, 400, 500, 507]  # 507 = Insufficient Storage
 
 @pytest.mark.integration
+@pytest.mark.xdist_group("temp_dir")
 class TestIntegrationCleanup:
     """Integration tests for cleanup functionality."""
     
-    @pytest.fixture
-    def client(self):
-        """Provide test client."""
-        return TestClient(app)
+    @pytest.fixture(autouse=True)
+    def clean_temp_dir(self):
+        """Remove stray files from the app's per-worker temp_dir, as the shared client keeps state between tests."""
+        with os.scandir(config.temp_dir) as entries:
+            for entry in entries:
+                if entry.is_file(follow_symlinks=False):
+                    os.unlink(entry.path)
     
     def test_temporary_file_cleanup(self, client):
         """Test that temporary files are cleaned up after conversion."""
-        from app import config
         temp_dir = config.temp_dir
         
         # Count files before conversion
-        initial_files = len(os.listdir(temp_dir)) if os.path.exists(temp_dir) else 0
+        initial_files = count_entries(temp_dir)
         
         # Perform conversion
         response = client.post(
@@ -360,12 +407,12 @@ class TestIntegrationCleanup:
             files={"file": ("test_cleanup.txt", b"Test content for cleanup", "text/plain")}
         )
         
-        # Wait a bit for cleanup to complete
-        import time
-        time.sleep(1)
+        # The response only returns once its background cleanup has run, so
+        # every output slot is already back in the queue
+        assert converter.slot_q.qsize() == len(converter.slots)
         
         # Count files after conversion
-        final_files = len(os.listdir(temp_dir)) if os.path.exists(temp_dir) else 0
+        final_files = count_entries(temp_dir, initial_files + 1)
         
         # Should not have significantly more files
         assert final_files <= initial_files + 1  # Allow for some temporary files
@@ -373,46 +420,39 @@ class TestIntegrationCleanup:
     @pytest.mark.slow
     def test_long_running_cleanup(self, client):
         """Test cleanup over multiple conversions."""
-        from app import config
         temp_dir = config.temp_dir
         
         # Perform multiple conversions
-        for i in range(5):
+        contents = [f"Content {i}".encode('utf-8') for i in range(5)]
+        for i, content in enumerate(contents):
             response = client.post(
                 "/convert",
-                files={"file": (f"test_{i}.txt", f"Content {i}".encode('utf-8'), "text/plain")}
+                files={"file": (f"test_{i}.txt", content, "text/plain")}
             )
             # Don't check status as conversions might fail in test environment
         
-        # Wait for cleanup
-        import time
-        time.sleep(2)
+        # Cleanup has finished once every output slot is back in the queue
+        assert converter.slot_q.qsize() == len(converter.slots)
         
         # Check that temp directory doesn't have too many files
-        if os.path.exists(temp_dir):
-            temp_files = os.listdir(temp_dir)
-            # Should not accumulate too many temporary files
-            assert len(temp_files) < 20  # Reasonable upper bound
+        # Should not accumulate too many temporary files
+        assert count_entries(temp_dir, 20) < 20  # Reasonable upper bound
 
 @pytest.mark.integration
+@pytest.mark.xdist_group("temp_dir")
 class TestIntegrationRealFiles:
     """Integration tests with real file formats (if available)."""
     
     def test_with_real_files_if_available(self, client, create_test_files):
         """Test conversion with real files if they exist."""
-        fixtures_dir = Path(__file__).parent / "fixtures"
-        
         test_files = [
             ("test_text.txt", "text/plain"),
             ("test_document.html", "text/html"),
         ]
         
         for filename, mimetype in test_files:
-            file_path = fixtures_dir / filename
-            if file_path.exists():
-                with open(file_path, 'rb') as f:
-                    content = f.read()
-                
+            content = create_test_files.get(filename)
+            if content is not None:
                 response = client.post(
                     "/convert",
                     files={"file": (filename, content, mimetype)}
@@ -427,48 +467,34 @@ class TestIntegrationRealFiles:
                 assert response.status_code in [200, 400, 500]
 
 # Utility functions for integration tests
+def count_entries(path: str, cap: Optional[int] = None) -> int:
+    """Count directory entries (0 if it is missing), stopping once the count exceeds cap."""
+    count = 0
+    try:
+        with os.scandir(path) as entries:
+            for _ in entries:
+                count += 1
+                if cap is not None and count > cap:
+                    break
+    except FileNotFoundError:
+        pass
+    return count
+
 def wait_for_service(url: str, timeout: int = 30) -> bool:
-    """Wait for service to be available."""
-    import time
+    """Wait for service to be available, polling over one kept-alive connection."""
     start_time = time.time()
     
-    while time.time() - start_time < timeout:
-        try:
-            response = requests.get(f"{url}/health", timeout=5)
-            if response.status_code == 200:
-                return True
-        except requests.exceptions.RequestException:
-            pass
-        time.sleep(1)
+    with httpx.Client(timeout=5, limits=httpx.Limits(max_keepalive_connections=1)) as probe_client:
+        attempt = 0
+        while time.time() - start_time < timeout:
+            try:
+                response = probe_client.get(f"{url}/health")
+                if response.status_code == 200:
+                    return True
+            except httpx.RequestError:
+                pass
+            # Back off from 0.1 s up to the previous fixed 1 s poll
+            time.sleep(min(1, 0.1 * 2 ** attempt))
+            attempt += 1
     
     return False
-
-def check_libreoffice_installation() -> bool:
-    """Check if LibreOffice is properly installed."""
-    try:
-        result = subprocess.run(
-            ['libreoffice', '--version'],
-            capture_output=True,
-            text=True,
-            timeout=10
-        )
-        return result.returncode == 0 and 'LibreOffice' in result.stdout
-    except (FileNotFoundError, subprocess.TimeoutExpired):
-        return False
-
-# Pytest hooks for integration tests
-def pytest_runtest_setup(item):
-    """Setup for integration tests."""
-    if item.get_closest_marker("integration"):
-        # Skip integration tests if LibreOffice is not available
-        if not check_libreoffice_installation():
-            pytest.skip("LibreOffice not available for integration tests")
-
-def pytest_configure(config):
-    """Configure integration test markers."""
-    config.addinivalue_line(
-        "markers", "integration: marks tests as integration tests requiring full environment"
-    )
-    config.addinivalue_line(
-        "markers", "slow: marks tests as slow integration tests"
-    )
\ No newline at end of file